@@ -0,0 +1,45 @@
+"""Shared setup for the benchmark scripts in this directory."""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(databases=None, **extra_settings):
+    """
+    Configure Django with ``databases``, or by default an in-memory SQLite
+    database using the transaction hooks backend as ``default``, and Django's
+    own SQLite backend as ``plain``.
+
+    """
+    from django.conf import settings
+    if databases is None:
+        databases = {
+            'default': {
+                'ENGINE': 'transaction_hooks.backends.sqlite3',
+                'NAME': ':memory:',
+                },
+            'plain': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+                },
+            }
+    settings.configure(DATABASES=databases, **extra_settings)
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def best_of(repeat, func):
+    """
+    Call ``func`` ``repeat`` times and return the shortest time it reported.
+
+    ``func`` does its own setup and returns the elapsed time of the part being
+    measured, so setup cost isn't counted.
+
+    """
+    return min(func() for _ in range(repeat))
+
+
+timer = timeit.default_timer
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Regression benchmark for draining the pending on-commit hook queue.
+
+Registers N no-op hooks inside a transaction and times the commit that runs
+them. Draining should be linear in N, so the per-hook cost must stay roughly
+flat from 10 to 100k hooks; exits non-zero if it grows by more than
+``--max-ratio`` between the smallest and largest run.
+
+Run from the repository root::
+
+    python benchmarks/drain.py
+
+"""
+import argparse
+import sys
+
+from common import best_of, setup_django, timer
+
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def time_drain(n, repeat):
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    def noop():
+        pass
+
+    def run():
+        block = atomic()
+        block.__enter__()
+        for _ in range(n):
+            connection.on_commit(noop)
+        start = timer()
+        block.__exit__(None, None, None)
+        return timer() - start
+
+    return best_of(repeat, run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ratio', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    per_hook = []
+    for n in SIZES:
+        elapsed = time_drain(n, args.repeat)
+        per_hook.append(elapsed / n)
+        print("%7d hooks: %10.3f ms total, %8.1f ns/hook" % (
+            n, elapsed * 1e3, elapsed / n * 1e9))
+
+    # Small runs are dominated by the fixed cost of COMMIT, so compare the
+    # largest run against the cheapest per-hook figure we saw.
+    ratio = per_hook[-1] / min(per_hook)
+    print("per-hook cost ratio (largest / cheapest): %.2f" % ratio)
+    if ratio > args.max_ratio:
+        print("FAIL: drain time is not scaling linearly")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compare the memory held by pending hooks registered as closures with
+``on_commit`` and as records with ``on_commit_call``.
+
+Each hook is for a model instance that is otherwise dropped right after
+registration, as in a loop over a queryset. A closure like
+``lambda: reindex(obj.pk)`` keeps the whole instance alive until commit;
+``on_commit_call(reindex, obj.pk)`` keeps only the primary key. Requires
+Python 3.4+ (for ``tracemalloc``). Run from the repository root::
+
+    python benchmarks/memory.py
+
+"""
+import argparse
+import sys
+import tracemalloc
+
+from common import setup_django
+
+
+def reindex(pk):
+    pass
+
+
+def pending_memory(n, register):
+    """Bytes still held after registering ``n`` hooks with ``register``."""
+    from django.db import connection
+    from django.db.transaction import atomic
+    from transaction_hooks.test.models import Thing
+
+    with atomic():
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for pk in range(n):
+            # a loaded instance, with a populated field cache
+            obj = Thing(pk=pk, num=pk)
+            obj.__dict__['_prefetched_objects_cache'] = {'tags': [pk] * 10}
+            register(connection, obj)
+        del obj
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        connection.set_rollback(True)
+    return after - before
+
+
+def closure(connection, obj):
+    connection.on_commit(lambda: reindex(obj.pk))
+
+
+def record(connection, obj):
+    connection.on_commit_call(reindex, obj.pk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    setup_django(INSTALLED_APPS=['transaction_hooks.test'])
+
+    results = {}
+    for name, register in [('on_commit(lambda)', closure),
+                           ('on_commit_call', record)]:
+        results[name] = pending_memory(args.n, register)
+        print("%-20s %10d bytes, %7.1f bytes/hook" % (
+            name, results[name], results[name] / float(args.n)))
+    print("on_commit_call uses %.1f%% of the memory" % (
+        100.0 * results['on_commit_call'] / results['on_commit(lambda)']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
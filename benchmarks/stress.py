@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+"""
+Multi-threaded stress test of the transaction hooks backends.
+
+Runs ``--threads`` threads, each on its own connection, doing short
+transactions: each writes a row and registers a random number of hooks, in
+randomly nested savepoints, some of which (and some whole transactions) are
+rolled back. Reports throughput, commit latency percentiles (the time to
+exit the outermost ``atomic`` block, including running its hooks) and the
+process's peak memory, and checks that exactly the hooks of committed
+transactions and savepoints ran, on the thread that registered them.
+
+Runs against a temporary SQLite database by default, or against PostgreSQL
+with ``--postgres`` (using the ``PGHOST``, ``PGPORT``, ``PGUSER`` and
+``PGPASSWORD`` environment variables, and ``--db-name``). Pass a previous
+``--output`` file as ``--compare`` to exit non-zero if throughput dropped, or
+p99 latency rose, by more than ``--tolerance``. Run from the repository
+root::
+
+    python benchmarks/stress.py --threads 8 --output stress.json
+    python benchmarks/stress.py --threads 8 --compare stress.json
+
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+
+from common import setup_django, timer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(ordered, fraction):
+    """The nearest-rank percentile of the sorted list ``ordered``."""
+    if not ordered:
+        return 0.0
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def peak_memory():
+    """This process's peak resident set size in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Worker(object):
+    """One thread's transactions, and what it measured."""
+    def __init__(self, index, args):
+        self.index = index
+        self.args = args
+        self.random = random.Random(args.seed + index)
+        self.thread = None
+        self.latencies = []
+        self.committed = 0
+        self.rolled_back = 0
+        # hooks that should have run, and hooks that did
+        self.expected = 0
+        self.ran = 0
+        self.wrong_thread = 0
+        self.error = None
+
+    def hook(self):
+        self.ran += 1
+        if threading.current_thread() is not self.thread:
+            self.wrong_thread += 1
+
+    def register(self, connection):
+        """Register a random number of hooks; return how many."""
+        count = self.random.randint(0, self.args.max_hooks)
+        for i in range(count):
+            if i % 2:
+                connection.on_commit(lambda: self.hook())
+            else:
+                connection.on_commit_call(self.hook)
+        return count
+
+    def savepoint(self, connection, depth):
+        """
+        Register hooks in a savepoint, with up to ``depth`` more nested in
+        it, rolling it back at random; return how many should run.
+
+        """
+        from django.db.transaction import atomic
+
+        try:
+            with atomic():
+                count = self.register(connection)
+                if depth > 1 and self.random.random() < 0.5:
+                    count += self.savepoint(connection, depth - 1)
+                if self.random.random() < self.args.rollback_rate:
+                    raise Rollback()
+            return count
+        except Rollback:
+            return 0
+
+    def transaction(self, connection, cursor):
+        from django.db.transaction import atomic
+
+        block = atomic()
+        block.__enter__()
+        try:
+            cursor.execute(
+                "INSERT INTO stress_rows (thread, n) VALUES (%s, %s)",
+                [self.index, self.committed])
+            count = self.register(connection)
+            for _ in range(self.random.randint(0, 2)):
+                count += self.savepoint(
+                    connection, self.random.randint(1, self.args.max_depth))
+            if self.random.random() < self.args.rollback_rate / 4:
+                raise Rollback()
+        except Rollback:
+            block.__exit__(*sys.exc_info())
+            self.rolled_back += 1
+            return
+        except BaseException:
+            if not block.__exit__(*sys.exc_info()):
+                raise
+        start = timer()
+        block.__exit__(None, None, None)
+        self.latencies.append(timer() - start)
+        self.committed += 1
+        self.expected += count
+
+    def run(self):
+        from django.db import connection
+
+        try:
+            with connection.cursor() as cursor:
+                for _ in range(self.args.transactions):
+                    self.transaction(connection, cursor)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            connection.close()
+
+
+def create_table():
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS stress_rows")
+        cursor.execute(
+            "CREATE TABLE stress_rows (thread integer, n integer)")
+    connection.close()
+
+
+def run(args):
+    create_table()
+    workers = [Worker(i, args) for i in range(args.threads)]
+    for worker in workers:
+        worker.thread = threading.Thread(target=worker.run)
+    start = timer()
+    for worker in workers:
+        worker.thread.start()
+    for worker in workers:
+        worker.thread.join()
+    elapsed = timer() - start
+
+    latencies = sorted(t for worker in workers for t in worker.latencies)
+    committed = sum(worker.committed for worker in workers)
+    results = {
+        'threads': args.threads,
+        'seconds': elapsed,
+        'committed': committed,
+        'rolled_back': sum(worker.rolled_back for worker in workers),
+        'commits_per_second': committed / elapsed,
+        'latency_ms': dict(
+            (name, 1000 * percentile(latencies, fraction))
+            for name, fraction in [
+                ('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]),
+        'hooks_expected': sum(worker.expected for worker in workers),
+        'hooks_run': sum(worker.ran for worker in workers),
+        'hooks_on_wrong_thread': sum(
+            worker.wrong_thread for worker in workers),
+        'peak_memory_bytes': peak_memory(),
+        'errors': [repr(worker.error) for worker in workers if worker.error],
+    }
+    return results
+
+
+def report(results):
+    print("%(threads)d threads: %(committed)d commits, %(rolled_back)d "
+          "rollbacks in %(seconds).2f s" % results)
+    print("throughput: %.1f commits/s" % results['commits_per_second'])
+    print("commit latency: p50 %(p50).3f ms, p90 %(p90).3f ms, "
+          "p99 %(p99).3f ms, max %(max).3f ms" % results['latency_ms'])
+    print("hooks run: %(hooks_run)d of %(hooks_expected)d expected, "
+          "%(hooks_on_wrong_thread)d on the wrong thread" % results)
+    if results['peak_memory_bytes'] is not None:
+        print("peak memory: %.1f MB" % (
+            results['peak_memory_bytes'] / 1024.0 / 1024))
+    for error in results['errors']:
+        print("error: %s" % error)
+
+
+def check(results):
+    """Return whether the hooks ran exactly as they should have."""
+    return (
+        not results['errors'] and
+        results['hooks_run'] == results['hooks_expected'] and
+        not results['hooks_on_wrong_thread'])
+
+
+def compare(results, baseline, tolerance):
+    """Return the names of the measurements that got worse than baseline."""
+    regressions = []
+    for name, value, before, worse in [
+        ('commits_per_second', results['commits_per_second'],
+         baseline['results']['commits_per_second'],
+         lambda ratio: ratio < 1 - tolerance),
+        ('latency_ms.p99', results['latency_ms']['p99'],
+         baseline['results']['latency_ms']['p99'],
+         lambda ratio: ratio > 1 + tolerance),
+    ]:
+        ratio = value / before if before else 1.0
+        flag = ''
+        if worse(ratio):
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-25s %12.3f vs %12.3f (%.2fx)%s" % (
+            name, value, before, ratio, flag))
+    return regressions
+
+
+def databases(args, directory):
+    if args.postgres:
+        return {
+            'default': {
+                'ENGINE': 'transaction_hooks.backends.postgresql_psycopg2',
+                'NAME': args.db_name,
+                'USER': os.environ.get('PGUSER', ''),
+                'PASSWORD': os.environ.get('PGPASSWORD', ''),
+                'HOST': os.environ.get('PGHOST', 'localhost'),
+                'PORT': os.environ.get('PGPORT', ''),
+                },
+            }
+    return {
+        'default': {
+            'ENGINE': 'transaction_hooks.backends.sqlite3',
+            'NAME': os.path.join(directory, 'stress.sqlite3'),
+            # threads take turns holding the write lock
+            'OPTIONS': {'timeout': 60},
+            },
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transactions', type=int, default=500,
+                        help="transactions per thread")
+    parser.add_argument('--max-hooks', type=int, default=20,
+                        help="most hooks registered per block")
+    parser.add_argument('--max-depth', type=int, default=3,
+                        help="deepest savepoint nesting")
+    parser.add_argument('--rollback-rate', type=float, default=0.1,
+                        help="chance of rolling back each savepoint")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--postgres', action='store_true',
+                        help="run against PostgreSQL rather than SQLite")
+    parser.add_argument('--db-name', default='dtc')
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="JSON results file to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup_django(databases(args, directory))
+        import django
+
+        results = run(args)
+    finally:
+        shutil.rmtree(directory)
+    report(results)
+    status = 0
+    if not check(results):
+        print("FAILED: hooks didn't run as expected")
+        status = 1
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'backend': 'postgresql' if args.postgres else 'sqlite3',
+                'results': results,
+                }, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
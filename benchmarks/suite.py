@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the transaction hooks hot paths, on the sqlite3 backend.
+
+Measures registering hooks with ``on_commit`` (one at a time, and with
+``on_commit_many`` and ``on_commit_call_many``), committing with N pending
+hooks, rolling back savepoints at various nesting depths and hook counts, and
+the overhead of the hooks backend over Django's own sqlite3 backend for
+transactions that register no hooks.
+
+Results are written as JSON (``--output``), keyed by benchmark name, with the
+best time per operation in nanoseconds. Pass a previous results file as
+``--compare`` to exit non-zero if any benchmark got more than ``--tolerance``
+slower. Run from the repository root::
+
+    python benchmarks/suite.py --output bench.json
+    python benchmarks/suite.py --compare bench.json
+
+"""
+import argparse
+import json
+import platform
+import sys
+
+from common import best_of, setup_django, timer
+
+
+def noop():
+    pass
+
+
+def noop_with_arg(arg):
+    pass
+
+
+def bench_register(n):
+    """Register ``n`` hooks inside a transaction."""
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    def run():
+        with atomic():
+            on_commit = connection.on_commit
+            start = timer()
+            for _ in range(n):
+                on_commit(noop)
+            elapsed = timer() - start
+            connection.set_rollback(True)
+        return elapsed
+    return run, n
+
+
+def bench_register_many(n):
+    """Register ``n`` hooks inside a transaction with one call."""
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    funcs = [noop] * n
+
+    def run():
+        with atomic():
+            start = timer()
+            connection.on_commit_many(funcs)
+            elapsed = timer() - start
+            connection.set_rollback(True)
+        return elapsed
+    return run, n
+
+
+def bench_register_call_many(n):
+    """Register ``n`` ``on_commit_call`` hooks with one call."""
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    args_list = [(i,) for i in range(n)]
+
+    def run():
+        with atomic():
+            start = timer()
+            connection.on_commit_call_many(noop_with_arg, args_list)
+            elapsed = timer() - start
+            connection.set_rollback(True)
+        return elapsed
+    return run, n
+
+
+def bench_commit(n):
+    """Commit a transaction with ``n`` pending hooks."""
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    def run():
+        block = atomic()
+        block.__enter__()
+        for _ in range(n):
+            connection.on_commit(noop)
+        start = timer()
+        block.__exit__(None, None, None)
+        return timer() - start
+    return run, 1
+
+
+def bench_savepoint_rollback(depth, hooks, total):
+    """
+    Roll back the innermost of ``depth`` nested savepoints, each of which
+    registered ``hooks`` hooks, with ``total`` hooks already pending outside
+    them.
+
+    """
+    from django.db import connection
+    from django.db.transaction import atomic
+
+    def run():
+        with atomic():
+            for _ in range(total):
+                connection.on_commit(noop)
+            sids = []
+            for _ in range(depth):
+                sids.append(connection.savepoint())
+                for _ in range(hooks):
+                    connection.on_commit(noop)
+            start = timer()
+            connection.savepoint_rollback(sids[-1])
+            elapsed = timer() - start
+            connection.set_rollback(True)
+        return elapsed
+    return run, 1
+
+
+def bench_transaction(using, n):
+    """
+    Run ``n`` empty transactions, each with one nested savepoint, on the
+    ``using`` connection.
+
+    """
+    from django.db.transaction import atomic
+
+    def run():
+        start = timer()
+        for _ in range(n):
+            with atomic(using=using):
+                with atomic(using=using):
+                    pass
+        return timer() - start
+    return run, n
+
+
+def benchmarks():
+    yield 'register[10000]', bench_register(10000)
+    yield 'register_many[10000]', bench_register_many(10000)
+    yield 'register_call_many[10000]', bench_register_call_many(10000)
+    for n in (0, 100, 10000):
+        yield 'commit[%d]' % n, bench_commit(n)
+    for depth in (1, 4, 8):
+        for hooks in (1, 100):
+            for total in (0, 10000):
+                yield (
+                    'savepoint_rollback[depth=%d,hooks=%d,pending=%d]'
+                    % (depth, hooks, total),
+                    bench_savepoint_rollback(depth, hooks, total))
+    for using in ('plain', 'default'):
+        yield 'transaction[%s]' % using, bench_transaction(using, 1000)
+
+
+def run_benchmarks(repeat, only=None):
+    results = {}
+    for name, (run, ops) in benchmarks():
+        if only and only not in name:
+            continue
+        results[name] = {
+            'ops': ops,
+            'ns_per_op': best_of(repeat, run) / ops * 1e9,
+            }
+        print("%-55s %12.1f ns/op" % (name, results[name]['ns_per_op']))
+    plain = results.get('transaction[plain]')
+    hooks = results.get('transaction[default]')
+    if plain and hooks:
+        print("mixin overhead per transaction: %+.1f ns (%+.1f%%)" % (
+            hooks['ns_per_op'] - plain['ns_per_op'],
+            (hooks['ns_per_op'] / plain['ns_per_op'] - 1) * 100))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the names of benchmarks more than ``tolerance`` slower."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['ns_per_op'] / before['ns_per_op']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-55s %6.2fx%s" % (name, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help="run benchmarks with this in the name")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="JSON results file to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    import django
+
+    results = run_benchmarks(args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'results': results,
+                }, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
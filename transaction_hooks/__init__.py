@@ -1 +1,3 @@
+from transaction_hooks.coordinated import on_commit  # noqa
+
 __version__ = '0.3'
@@ -0,0 +1,134 @@
+"""
+Schedule coroutine on-commit hooks on an asyncio event loop.
+
+A coroutine function (or an awaitable, such as a coroutine object) passed to
+``on_commit`` is not called on the committing thread; after commit it is
+handed to the loop set with ``set_event_loop``, which may be running in
+another thread. ``connection.async_commit_hooks()`` returns an
+``AsyncHookGroup`` that can be awaited for all of a transaction's coroutine
+hooks to finish.
+
+"""
+import inspect
+import threading
+import types
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import asyncio
+    from concurrent import futures
+except ImportError:  # Python 2
+    asyncio = futures = None
+
+
+_loop = None
+
+CO_COROUTINE = getattr(inspect, 'CO_COROUTINE', 0)
+# code flags of ``async def`` functions and of generators decorated with
+# ``types.coroutine`` (or ``asyncio.coroutine``)
+CO_ASYNC = CO_COROUTINE | getattr(inspect, 'CO_ITERABLE_COROUTINE', 0)
+
+
+def set_event_loop(loop):
+    """Set the event loop coroutine hooks are scheduled on (or ``None``)."""
+    global _loop
+    _loop = loop
+
+
+def get_event_loop():
+    if _loop is None:
+        raise ImproperlyConfigured(
+            "Coroutine on-commit hooks need an event loop; call "
+            "transaction_hooks.aio.set_event_loop() first.")
+    return _loop
+
+
+def is_async_hook(func):
+    """Is ``func`` a coroutine function or an awaitable?"""
+    if asyncio is None:
+        return False
+    if func.__class__ is types.FunctionType:
+        # fast path for the common case; on_commit calls this for every hook
+        return bool(func.__code__.co_flags & CO_COROUTINE or
+                    '_is_coroutine' in func.__dict__)
+    return not callable(func) or asyncio.iscoroutinefunction(func)
+
+
+def schedule(awaitable, loop):
+    """
+    Run ``awaitable`` on ``loop`` from any thread; return a
+    ``concurrent.futures.Future`` for its result.
+
+    """
+    result = futures.Future()
+
+    def start():
+        try:
+            task = asyncio.ensure_future(awaitable, loop=loop)
+        except BaseException as exc:
+            result.set_exception(exc)
+            return
+        task.add_done_callback(lambda task: _copy_result(task, result))
+
+    loop.call_soon_threadsafe(start)
+    return result
+
+
+def _copy_result(source, destination):
+    if source.cancelled():
+        destination.cancel()
+    elif source.exception() is not None:
+        destination.set_exception(source.exception())
+    else:
+        destination.set_result(source.result())
+
+
+class AsyncHookGroup(object):
+    """
+    The coroutine hooks scheduled after one transaction commits.
+
+    ``done`` is a ``concurrent.futures.Future`` that resolves once the
+    transaction has ended and every hook it scheduled has finished, to the
+    list of their results (or to the first error); if the transaction was
+    rolled back, to an empty list. ``wait()`` returns the same as an asyncio
+    future, for use with ``await``.
+
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.done = futures.Future()
+        self.futures = []
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def add(self, future):
+        with self.lock:
+            self.futures.append(future)
+            self.pending += 1
+        future.add_done_callback(self._finished)
+
+    def close(self):
+        """Called when the transaction ends; no more hooks will be added."""
+        with self.lock:
+            self.closed = True
+            self._check()
+
+    def _finished(self, future):
+        with self.lock:
+            self.pending -= 1
+            self._check()
+
+    def _check(self):
+        if not self.closed or self.pending or self.done.done():
+            return
+        for f in self.futures:
+            if not f.cancelled() and f.exception() is not None:
+                self.done.set_exception(f.exception())
+                return
+        self.done.set_result(
+            [None if f.cancelled() else f.result() for f in self.futures])
+
+    def wait(self):
+        return asyncio.wrap_future(self.done, loop=self.loop)
@@ -0,0 +1,112 @@
+"""
+Bound the time a commit spends running hooks on the committing thread.
+
+With ``TRANSACTION_HOOKS_LATENCY_BUDGET`` set, hooks run on the committing
+thread, in order, until ``BUDGET`` seconds have passed; the rest are
+submitted, still in order, as one task to the executor named ``EXECUTOR``
+(in ``TRANSACTION_HOOKS_EXECUTORS``). How long each hook takes is learned
+across transactions, by name, and hooks that usually take longer than
+``SLOW_HOOK`` seconds are sent to the executor up front.
+
+"""
+import functools
+import sys
+import timeit
+
+from django.db import close_old_connections
+
+from transaction_hooks import errors, executors
+from transaction_hooks.hooks import CommitHook
+from transaction_hooks.metrics import hook_name
+
+# weight of the latest duration in a hook's learned (moving average) duration
+LEARNING_RATE = 0.2
+
+# the learned duration of each hook, in seconds, by name
+durations = {}
+
+
+def get_config(setting):
+    """Fill in the defaults of a ``TRANSACTION_HOOKS_LATENCY_BUDGET``."""
+    if setting is None:
+        return None
+    config = {'BUDGET': 0.05, 'EXECUTOR': 'default', 'SLOW_HOOK': None}
+    config.update(setting)
+    if config['SLOW_HOOK'] is None:
+        config['SLOW_HOOK'] = config['BUDGET']
+    return config
+
+
+def is_dispatcher(func):
+    """Does ``func`` only hand its work on (so it must run at commit)?"""
+    while isinstance(func, CommitHook):
+        if func.dispatches:
+            return True
+        func = func.func
+    return False
+
+
+def learn(name, duration):
+    previous = durations.get(name)
+    if previous is None:
+        durations[name] = duration
+    else:
+        durations[name] = previous + LEARNING_RATE * (duration - previous)
+
+
+def is_slow(name, threshold):
+    return durations.get(name, 0.0) > threshold
+
+
+def run_timed_hooks(funcs, isolate=False, retry=False, error_handler=None):
+    """
+    Run ``funcs`` in order, and return how long each took.
+
+    Stops at the first one that raises, unless ``isolate``; then the failures
+    are dealt with once all have run, as ``errors.handle_failures`` does with
+    ``retry`` and ``error_handler``.
+
+    """
+    timer = timeit.default_timer
+    timings = []
+    failures = []
+    try:
+        for func in funcs:
+            start = timer()
+            try:
+                func()
+            except Exception:
+                if not isolate:
+                    raise
+                failures.append((func, sys.exc_info()))
+            timings.append(timer() - start)
+    finally:
+        # don't leave the worker holding connections the hooks opened
+        close_old_connections()
+    if failures:
+        errors.handle_failures(failures, retry, error_handler)
+    return timings
+
+
+def submit_hooks(name, funcs, isolate=False, retry=False,
+                 error_handler=None):
+    """
+    Submit ``funcs`` (hooks from one transaction, in order) to the executor
+    configured as ``name``, as a single task, and learn how long they took.
+    The other arguments are passed on to ``run_timed_hooks``.
+
+    """
+    names = [hook_name(func) for func in funcs]
+
+    def learn_durations(future):
+        if not future.cancelled() and future.exception() is None:
+            for name, duration in zip(names, future.result()):
+                learn(name, duration)
+
+    task = functools.partial(
+        run_timed_hooks, isolate=isolate, retry=retry,
+        error_handler=error_handler)
+    future = executors.submit_hooks(name, funcs, task)
+    if future is not None:
+        future.add_done_callback(learn_durations)
+    return future
@@ -0,0 +1,76 @@
+"""
+Hooks that run once after transactions on several databases all commit.
+
+``on_commit(func, using=['default', 'shard_1'])`` registers a record with
+each alias's connection. When one of those transactions commits, its record
+checks the alias off; when the last one does, ``func()`` runs. If any of the
+records is discarded (by a rollback of its transaction, or of a savepoint it
+was registered in), ``func`` never runs.
+
+"""
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import six
+
+from transaction_hooks.hooks import CommitHook
+
+
+class JointCommit(object):
+    """The state shared by the records of one hook across its aliases."""
+    def __init__(self, aliases):
+        self.lock = threading.Lock()
+        # aliases that haven't committed yet
+        self.waiting = set(aliases)
+        self.discarded = False
+
+    def committed(self, alias):
+        """Check ``alias`` off; return whether the hook should run now."""
+        with self.lock:
+            self.waiting.discard(alias)
+            return not self.waiting and not self.discarded
+
+
+class JointCommitHook(CommitHook):
+    """``alias``'s record of a hook that runs once ``joint`` has committed."""
+    __slots__ = ('joint', 'alias')
+
+    def __init__(self, func, joint, alias):
+        super(JointCommitHook, self).__init__(func)
+        self.joint = joint
+        self.alias = alias
+
+    def __call__(self):
+        if self.joint.committed(self.alias):
+            self.func()
+
+    def discard(self, connection):
+        self.joint.discarded = True
+
+
+def on_commit(func, using=None):
+    """
+    Call ``func()`` once the current transactions on all the database aliases
+    ``using`` (one alias, or a list of them; the default database if None)
+    have committed, or never if any of them rolls back.
+
+    ``func`` runs on whichever connection commits last, in its place among
+    that connection's hooks. An alias with no transaction in progress counts
+    as committed, so if none has one, ``func()`` is called immediately.
+
+    """
+    if using is None:
+        using = [DEFAULT_DB_ALIAS]
+    elif isinstance(using, six.string_types):
+        using = [using]
+    aliases = []
+    for alias in using:
+        if alias not in aliases:
+            aliases.append(alias)
+    joint = JointCommit(aliases)
+    for alias in aliases:
+        # the record only checks its alias off, so it stays on the committing
+        # thread and out of the outbox
+        connections[alias]._add_commit_hook(
+            JointCommitHook(func, joint, alias), key=None, executor=False,
+            priority=0, outbox=False, is_async=False)
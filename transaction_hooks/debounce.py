@@ -0,0 +1,111 @@
+"""
+Run hooks at most once per time window per key, across transactions.
+
+A hook registered with ``on_commit(func, debounce_key=key, window=seconds)``
+is handed, when its transaction commits, to ``debouncer``, this process's
+``Debouncer``. The first hand-off for a key schedules a run ``window``
+seconds later; any more for the same key before then just replace the
+function to run, so however many transactions (on any thread) commit the
+hook in that window, it runs once, on the debouncer's thread.
+
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import timeit
+
+from transaction_hooks.hooks import CommitHook
+
+
+logger = logging.getLogger('transaction_hooks')
+
+# seconds to wait for more of the same hook, if no window is given
+DEFAULT_WINDOW = 0.5
+
+
+class Debouncer(object):
+    def __init__(self):
+        self.condition = threading.Condition()
+        # maps each key with a scheduled run to [deadline, func]
+        self.pending = {}
+        # a heap of (deadline, sequence number, key)
+        self.deadlines = []
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def submit(self, key, window, func):
+        """
+        Run ``func`` ``window`` seconds from now, or, if ``key`` is already
+        scheduled to run, run ``func`` then instead.
+
+        """
+        with self.condition:
+            entry = self.pending.get(key)
+            if entry is not None:
+                entry[1] = func
+                return
+            deadline = timeit.default_timer() + window
+            self.pending[key] = [deadline, func]
+            heapq.heappush(
+                self.deadlines, (deadline, next(self.sequence), key))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name='transaction_hooks.debounce')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def flush(self):
+        """Run every scheduled hook now, on the calling thread."""
+        with self.condition:
+            entries = sorted(self.pending.values(), key=lambda e: e[0])
+            self.pending.clear()
+            del self.deadlines[:]
+        for deadline, func in entries:
+            self._call(func)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    delay = None
+                    if self.deadlines:
+                        delay = self.deadlines[0][0] - timeit.default_timer()
+                        if delay <= 0:
+                            break
+                    self.condition.wait(delay)
+                deadline, _, key = heapq.heappop(self.deadlines)
+                func = self.pending.pop(key)[1]
+            self._call(func)
+
+    def _call(self, func):
+        try:
+            func()
+        except Exception:
+            logger.exception("Error running debounced on-commit hook %r",
+                             func)
+
+
+# the debouncer for this process
+debouncer = Debouncer()
+
+# hooks still waiting for their window to end run before the process exits
+atexit.register(debouncer.flush)
+
+
+class DebouncedCommitHook(CommitHook):
+    """A hook to hand to ``debouncer`` under ``key`` when run."""
+    __slots__ = ('key', 'window')
+
+    spillable = True
+    dispatches = True
+
+    def __init__(self, func, key, window):
+        super(DebouncedCommitHook, self).__init__(func)
+        self.key = key
+        self.window = DEFAULT_WINDOW if window is None else window
+
+    def __call__(self):
+        debouncer.submit(self.key, self.window, self.func)
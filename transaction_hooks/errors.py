@@ -0,0 +1,175 @@
+"""
+Keep running a transaction's hooks when one of them fails.
+
+With ``TRANSACTION_HOOKS_ISOLATE_ERRORS = True``, an error in one hook
+doesn't stop the hooks after it. Once all have run, the failures are raised
+together as ``CommitHookErrors``, or passed to the callable named by
+``TRANSACTION_HOOKS_ERROR_HANDLER``; or, with ``TRANSACTION_HOOKS_RETRY``
+set, the failed hooks are retried with exponential backoff on a background
+thread, and only those that fail every attempt are reported (to the error
+handler, or the ``transaction_hooks`` logger).
+
+"""
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import timeit
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from transaction_hooks.hooks import CommitHook
+
+
+logger = logging.getLogger('transaction_hooks')
+
+
+class CommitHookErrors(Exception):
+    """
+    Errors raised by hooks that ran after a commit.
+
+    ``errors`` is a list of ``(hook, exc_info)`` tuples, in the order the
+    hooks ran.
+
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(CommitHookErrors, self).__init__(
+            "%d on-commit hook(s) failed: %s" % (
+                len(errors),
+                '; '.join(repr(exc_info[1]) for _, exc_info in errors)))
+
+
+class HookStormError(Exception):
+    """
+    The same hook was registered in one transaction more times than
+    ``TRANSACTION_HOOKS_STORM_THRESHOLD``, with
+    ``TRANSACTION_HOOKS_STORM_STRICT`` on.
+
+    """
+
+
+def get_error_handler():
+    """The callable ``TRANSACTION_HOOKS_ERROR_HANDLER`` names, or None."""
+    handler = getattr(settings, 'TRANSACTION_HOOKS_ERROR_HANDLER', None)
+    if isinstance(handler, six.string_types):
+        handler = import_string(handler)
+    return handler
+
+
+def handle_failures(failures, retry=False, error_handler=None):
+    """
+    Deal with the ``(hook, exc_info)`` tuples ``failures`` of hooks run with
+    errors isolated: retry them if ``retry``, else pass them to
+    ``error_handler`` if set, else raise them as ``CommitHookErrors``.
+
+    """
+    if retry:
+        queue = get_retry_queue()
+        for func, exc_info in failures:
+            logger.warning(
+                "On-commit hook %r failed; retrying", func, exc_info=exc_info)
+            queue.add(func.retry() if isinstance(func, CommitHook) else func)
+    elif error_handler is not None:
+        error_handler(failures)
+    else:
+        raise CommitHookErrors(failures)
+
+
+class RetryQueue(object):
+    """
+    Retries failed hooks on a background thread, waiting ``backoff`` seconds
+    before the first retry and twice as long before each one after that (up
+    to ``max_backoff``), and gives up after ``max_attempts`` retries.
+
+    """
+    def __init__(self, max_attempts=5, backoff=1.0, max_backoff=60.0,
+                 error_handler=None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.error_handler = error_handler
+        self.condition = threading.Condition()
+        # a heap of (due time, sequence number, hook, attempt)
+        self.scheduled = []
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def __len__(self):
+        return len(self.scheduled)
+
+    def add(self, func, attempt=1):
+        """Schedule retry number ``attempt`` of ``func``."""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        with self.condition:
+            heapq.heappush(self.scheduled, (
+                timeit.default_timer() + delay, next(self.sequence), func,
+                attempt))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name='transaction_hooks.retry')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    delay = None
+                    if self.scheduled:
+                        delay = self.scheduled[0][0] - timeit.default_timer()
+                        if delay <= 0:
+                            break
+                    self.condition.wait(delay)
+                _, _, func, attempt = heapq.heappop(self.scheduled)
+            self._retry(func, attempt)
+
+    def _retry(self, func, attempt):
+        try:
+            func()
+        except Exception:
+            exc_info = sys.exc_info()
+            if attempt < self.max_attempts:
+                logger.warning(
+                    "On-commit hook %r failed on retry %d; retrying",
+                    func, attempt, exc_info=exc_info)
+                self.add(func, attempt + 1)
+            else:
+                self.give_up(func, exc_info)
+        finally:
+            # don't hold a connection open between retries
+            close_old_connections()
+
+    def give_up(self, func, exc_info):
+        if self.error_handler is not None:
+            try:
+                self.error_handler([(func, exc_info)])
+                return
+            except Exception:
+                logger.exception("Error in on-commit hook error handler")
+        logger.error("On-commit hook %r failed on every retry", func,
+                     exc_info=exc_info)
+
+
+_retry_queue = None
+_lock = threading.Lock()
+
+
+def get_retry_queue():
+    """Return the ``RetryQueue`` configured by ``TRANSACTION_HOOKS_RETRY``."""
+    global _retry_queue
+    with _lock:
+        if _retry_queue is None:
+            config = getattr(settings, 'TRANSACTION_HOOKS_RETRY', None) or {}
+            _retry_queue = RetryQueue(
+                max_attempts=config.get('MAX_ATTEMPTS', 5),
+                backoff=config.get('BACKOFF', 1.0),
+                max_backoff=config.get('MAX_BACKOFF', 60.0),
+                error_handler=get_error_handler(),
+            )
+        return _retry_queue
@@ -0,0 +1,207 @@
+"""
+Run on-commit hooks off the committing thread, in a ``concurrent.futures``
+executor.
+
+Executors are configured by name in the ``TRANSACTION_HOOKS_EXECUTORS``
+setting, created the first time they are used, and shut down (waiting for
+queued hooks to finish) when the process exits.
+
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from django.utils.six.moves import cPickle as pickle
+
+from transaction_hooks.hooks import CommitHook
+
+try:
+    from concurrent import futures
+except ImportError:  # Python 2 without the "futures" backport
+    futures = None
+
+
+logger = logging.getLogger('transaction_hooks')
+
+BACKENDS = {
+    'thread': 'concurrent.futures.ThreadPoolExecutor',
+    'process': 'concurrent.futures.ProcessPoolExecutor',
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+
+class BoundedExecutor(object):
+    """
+    Wrap an executor so that at most ``max_pending`` submitted tasks are
+    queued or running at once; ``submit`` blocks until a slot is free.
+
+    """
+    def __init__(self, executor, max_pending):
+        self.executor = executor
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # are submitted tasks pickled (to be sent to another process)?
+        self.pickles = isinstance(executor, futures.ProcessPoolExecutor)
+
+    def submit(self, fn, *args, **kwargs):
+        # a task that can't be pickled would fail in a process pool's feeder
+        # thread, leaving its future (and so its slot) unresolved for good
+        check_picklable(self, fn, args, kwargs)
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        self.slots.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def get_executor(name):
+    """Return the ``BoundedExecutor`` configured as ``name``."""
+    try:
+        return _executors[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _executors:
+            _executors[name] = _create_executor(name)
+        return _executors[name]
+
+
+def _create_executor(name):
+    config = getattr(settings, 'TRANSACTION_HOOKS_EXECUTORS', {}).get(name)
+    if config is None:
+        raise ImproperlyConfigured(
+            "No executor named %r in TRANSACTION_HOOKS_EXECUTORS." % name)
+    if futures is None:
+        raise ImproperlyConfigured(
+            "Running on-commit hooks in an executor requires "
+            "concurrent.futures (the 'futures' package on Python 2).")
+    backend = config.get('BACKEND', 'thread')
+    executor_class = import_string(BACKENDS.get(backend, backend))
+    executor = executor_class(max_workers=config.get('MAX_WORKERS', 4))
+    return BoundedExecutor(executor, config.get('MAX_PENDING', 100))
+
+
+def shutdown_executors(wait=True):
+    """Shut down every executor created so far; used at process exit."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+atexit.register(shutdown_executors)
+
+
+def run_hooks(funcs):
+    """Run ``funcs`` in order; stop at the first one that raises."""
+    try:
+        for func in funcs:
+            func()
+    finally:
+        # don't leave the worker holding connections the hooks opened
+        close_old_connections()
+
+
+def submit_hooks(name, funcs, task=run_hooks):
+    """
+    Submit ``funcs`` (hooks from one transaction, in order) to the executor
+    configured as ``name``, as a single ``task(funcs)``.
+
+    Errors submitting the task (e.g. hooks that can't be pickled) are logged,
+    and None returned, as there's no caller to raise them to after commit.
+
+    """
+    try:
+        future = get_executor(name).submit(task, funcs)
+    except Exception as exc:
+        logger.error(
+            "Error submitting on-commit hooks to executor %r: %r", name, exc,
+            exc_info=True)
+        return None
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _log_failure(future):
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        logger.error(
+            "Error running on-commit hooks in an executor: %r", exc,
+            exc_info=(type(exc), exc, getattr(exc, '__traceback__', None)))
+
+
+class SubmitCommitHook(CommitHook):
+    """
+    A hook registered with ``on_commit_submit``: ``func(*args, **kwargs)``,
+    submitted to ``executor`` as a task of its own.
+
+    ``future`` is the ``Future`` returned to the caller at registration. It
+    gets the task's result or exception, or is cancelled if the hook is
+    discarded.
+
+    """
+    __slots__ = ('args', 'kwargs', 'executor', 'future')
+
+    dispatches = True
+
+    def __init__(self, func, args, kwargs, executor):
+        super(SubmitCommitHook, self).__init__(func)
+        self.args = args
+        self.kwargs = kwargs
+        self.executor = executor
+        self.future = futures.Future()
+
+    def __call__(self):
+        if not self.future.set_running_or_notify_cancel():
+            # cancelled by the caller before commit
+            return
+        try:
+            submitted = self.executor.submit(
+                self.func, *self.args, **self.kwargs)
+        except Exception as exc:
+            # e.g. the executor has been shut down; the caller finds out
+            # through the future, and later hooks still run
+            logger.error("Error submitting an on-commit hook: %r", exc)
+            self.future.set_exception(exc)
+            return
+        submitted.add_done_callback(self._resolve)
+
+    def _resolve(self, submitted):
+        if submitted.cancelled():
+            self.future.set_exception(futures.CancelledError())
+            return
+        exc = submitted.exception()
+        if exc is not None:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(submitted.result())
+
+    def discard(self, connection):
+        self.future.cancel()
+
+
+def check_picklable(executor, func, args, kwargs):
+    """
+    Raise an error now, rather than in the executor after commit, if the task
+    can't be sent to ``executor``.
+
+    """
+    if executor.pickles:
+        pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,205 @@
+import timeit
+
+from transaction_hooks import aio
+
+
+class CommitHook(object):
+    """
+    A pending on-commit hook that needs more bookkeeping than a bare function.
+
+    Plain hooks are stored in ``run_on_commit`` as-is; anything that needs to
+    know when it is discarded (e.g. by a savepoint rollback) is wrapped in a
+    ``CommitHook`` subclass instead. Calling the record runs the hook.
+
+    """
+    __slots__ = ('func',)
+
+    # may a SpillableQueue pickle this record to disk (if ``func`` is a
+    # module-level function)? Not if it shares state with the connection or
+    # other records.
+    spillable = False
+
+    # does running this record only hand ``func`` on to run elsewhere? Such
+    # records always run at commit, even past the latency budget.
+    dispatches = False
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        self.func()
+
+    def discard(self, connection):
+        """Called when the hook is dropped from ``connection`` unrun."""
+        if isinstance(self.func, CommitHook):
+            self.func.discard(connection)
+
+    def retry(self):
+        """Return a hook that repeats this one's failed call."""
+        return self
+
+
+class CallCommitHook(CommitHook):
+    """A hook registered with ``on_commit_call``: ``func(*args)``."""
+    __slots__ = ('args',)
+
+    spillable = True
+
+    def __init__(self, func, args):
+        # set directly, rather than through super(), as these are created in
+        # bulk by on_commit_call_many
+        self.func = func
+        self.args = args
+
+    def __call__(self):
+        self.func(*self.args)
+
+
+class KeyedCommitHook(CommitHook):
+    """
+    A hook registered with a deduplication key.
+
+    Only one hook per key runs per transaction. Every live registration for a
+    key is kept (in ``connection.commit_hook_keys``) so that if the winning
+    one is discarded by a savepoint rollback, the previous one takes over.
+
+    """
+    __slots__ = ('key', 'superseded')
+
+    def __init__(self, func, key):
+        super(KeyedCommitHook, self).__init__(func)
+        self.key = key
+        self.superseded = False
+
+    def __call__(self):
+        if not self.superseded:
+            self.func()
+
+    def discard(self, connection):
+        super(KeyedCommitHook, self).discard(connection)
+        registered = connection.commit_hook_keys.get(self.key)
+        if not registered:
+            return
+        # discards happen newest-first, so this is the latest registration
+        registered.pop()
+        if registered:
+            registered[-1].superseded = False
+        else:
+            del connection.commit_hook_keys[self.key]
+
+
+class BatchCommitHook(CommitHook):
+    """
+    Collects the items passed to ``on_commit_batch`` for one handler.
+
+    The same record is queued once per item, so that a savepoint rollback
+    discards exactly the items registered under it. The first occurrence to
+    run calls ``func(items)`` with everything collected; the rest do nothing.
+
+    """
+    __slots__ = ('items', 'failed_items')
+
+    def __init__(self, func):
+        super(BatchCommitHook, self).__init__(func)
+        self.items = []
+        self.failed_items = None
+
+    def __call__(self):
+        items, self.items = self.items, []
+        if items:
+            try:
+                self.func(items)
+            except Exception:
+                self.failed_items = items
+                raise
+
+    def retry(self):
+        return CallCommitHook(self.func, (self.failed_items,))
+
+    def discard(self, connection):
+        if not self.items:
+            # already run, or already discarded along with all its items
+            return
+        self.items.pop()
+        if not self.items:
+            # the handler's first queued occurrence is gone with its item
+            connection.commit_hook_batches.pop(self.func, None)
+
+
+class ExecutorCommitHook(CommitHook):
+    """
+    A hook to be run in an executor rather than on the committing thread.
+
+    Running the record only appends ``func`` to ``dispatched``, the list of
+    hooks from this transaction bound for the same executor; the connection
+    submits that list as one task once all the transaction's hooks have run.
+
+    """
+    __slots__ = ('dispatched',)
+
+    dispatches = True
+
+    def __init__(self, func, dispatched):
+        super(ExecutorCommitHook, self).__init__(func)
+        self.dispatched = dispatched
+
+    def __call__(self):
+        self.dispatched.append(self.func)
+
+
+class AsyncCommitHook(CommitHook):
+    """
+    A coroutine function (or awaitable) to schedule on the event loop of
+    ``group``, the ``AsyncHookGroup`` for its transaction.
+
+    """
+    __slots__ = ('group',)
+
+    dispatches = True
+
+    def __init__(self, func, group):
+        super(AsyncCommitHook, self).__init__(func)
+        self.group = group
+
+    def __call__(self):
+        awaitable = self.func() if callable(self.func) else self.func
+        self.group.add(aio.schedule(awaitable, self.group.loop))
+
+    def discard(self, connection):
+        if not callable(self.func) and hasattr(self.func, 'close'):
+            # don't warn that a discarded coroutine was never awaited
+            self.func.close()
+
+
+class PriorityCommitHook(CommitHook):
+    """A hook registered with a non-default ``priority``."""
+    __slots__ = ('priority',)
+
+    def __init__(self, func, priority):
+        super(PriorityCommitHook, self).__init__(func)
+        self.priority = priority
+
+
+class ProfiledCommitHook(CommitHook):
+    """
+    A hook counted in ``profile`` (a ``profiling.HookProfile``) under
+    ``site``, where it was registered.
+
+    """
+    __slots__ = ('site', 'profile')
+
+    def __init__(self, func, site, profile):
+        super(ProfiledCommitHook, self).__init__(func)
+        self.site = site
+        self.profile = profile
+
+    def __call__(self):
+        start = timeit.default_timer()
+        try:
+            self.func()
+        finally:
+            self.profile.executed(self.site, timeit.default_timer() - start)
+
+    def discard(self, connection):
+        self.profile.discarded(self.site)
+        super(ProfiledCommitHook, self).discard(connection)
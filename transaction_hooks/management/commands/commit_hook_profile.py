@@ -0,0 +1,52 @@
+from optparse import make_option
+import os
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction_hooks import profiling
+
+
+class Command(BaseCommand):
+    help = ("Report the on-commit hook profiles saved in "
+            "TRANSACTION_HOOKS_PROFILE_DIR, costliest first.")
+
+    if django.VERSION < (1, 8):
+        option_list = BaseCommand.option_list + (
+            make_option('--dir', default=None),
+            make_option('--sort', type='choice', choices=profiling.SORT_KEYS,
+                        default='total'),
+            make_option('--limit', type='int', default=None),
+            make_option('--reset', action='store_true', default=False),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir', default=None,
+            help="Directory of saved profiles. Defaults to "
+            "TRANSACTION_HOOKS_PROFILE_DIR.")
+        parser.add_argument(
+            '--sort', choices=profiling.SORT_KEYS, default='total',
+            help="Sort by total or max execution time, mean execution time, "
+            "registrations, or discard rate. Defaults to total.")
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help="Report only this many sites.")
+        parser.add_argument(
+            '--reset', action='store_true', default=False,
+            help="Delete the saved profiles after reporting them.")
+
+    def handle(self, **options):
+        directory = options['dir'] or profiling.profile_dir()
+        if not directory:
+            raise CommandError(
+                "Set TRANSACTION_HOOKS_PROFILE_DIR or pass --dir.")
+        if not os.path.isdir(directory):
+            raise CommandError("%s is not a directory." % directory)
+        combined = profiling.load(directory)
+        for line in combined.report(options['sort'], options['limit']):
+            self.stdout.write(line)
+        if options['reset']:
+            for filename in os.listdir(directory):
+                if filename.endswith('.json'):
+                    os.remove(os.path.join(directory, filename))
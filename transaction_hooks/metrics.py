@@ -0,0 +1,88 @@
+"""
+Counts and timings of on-commit hooks, per transaction.
+
+Collection is off unless the ``TRANSACTION_HOOKS_STATS_SINK`` setting names a
+callable (e.g. ``'transaction_hooks.metrics.send_signal'``); it is then called
+with a ``CommitHookStats`` for each transaction, on each connection, that
+registered or discarded any hooks.
+
+"""
+import functools
+
+from transaction_hooks.hooks import CommitHook
+from transaction_hooks.signals import commit_hook_stats
+
+
+class CommitHookStats(object):
+    """Hook counts and timings for one transaction on one connection."""
+    def __init__(self, alias):
+        self.alias = alias
+        # hooks queued for execution at commit
+        self.registered = 0
+        # hooks run after commit
+        self.executed = 0
+        # hooks discarded by a rollback of the transaction
+        self.discarded_rollback = 0
+        # hooks discarded by a rollback to a savepoint
+        self.discarded_savepoint_rollback = 0
+        # hooks discarded because the connection was closed or reopened
+        self.discarded_connection = 0
+        # hooks not run because an earlier hook raised
+        self.discarded_error = 0
+        # hooks sent past the latency budget to run in an executor
+        self.handed_off = 0
+        # the most hooks pending at once
+        self.peak_pending = 0
+        # timer value just after COMMIT, or None if never committed
+        self.committed_at = None
+        # a (hook name, delay since commit, duration) tuple, in seconds, for
+        # each hook run
+        self.hook_timings = []
+
+    @property
+    def discarded(self):
+        return (self.discarded_rollback + self.discarded_savepoint_rollback +
+                self.discarded_connection + self.discarded_error)
+
+    @property
+    def hook_time(self):
+        """Total time spent running hooks, in seconds."""
+        return sum(duration for name, delay, duration in self.hook_timings)
+
+    def __repr__(self):
+        return (
+            '<CommitHookStats %s: %d registered, %d executed, %d discarded>'
+            % (self.alias, self.registered, self.executed, self.discarded))
+
+
+def hook_name(func):
+    """A readable dotted name for the function behind a pending hook."""
+    while isinstance(func, CommitHook):
+        func = func.func
+    name = getattr(func, '__qualname__', None) or getattr(
+        func, '__name__', None)
+    if name is None:
+        return repr(func)
+    return '%s.%s' % (getattr(func, '__module__', None), name)
+
+
+def hook_identity(func):
+    """
+    What makes hooks "the same" for counting registrations: the code object
+    of the function behind the hook (so a lambda created in a loop is one
+    hook), or its name if it has none.
+
+    """
+    while isinstance(func, CommitHook):
+        func = func.func
+    while isinstance(func, functools.partial):
+        func = func.func
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        return code
+    return hook_name(func)
+
+
+def send_signal(stats):
+    """A stats sink that sends the ``commit_hook_stats`` signal."""
+    commit_hook_stats.send(sender=CommitHookStats, stats=stats)
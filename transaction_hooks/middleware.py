@@ -0,0 +1,102 @@
+"""
+Run the on-commit hooks of a request's transactions after its response.
+
+Hooks registered in transactions committed while handling a request normally
+run right after each commit, so the client waits for them. With
+``DeferCommitHooksMiddleware`` in ``MIDDLEWARE_CLASSES`` (or the WSGI
+application wrapped in ``DeferCommitHooksWSGIMiddleware``), they are held
+until the response has been sent and closed, and run then.
+
+"""
+import logging
+
+from django.db import connections
+
+
+logger = logging.getLogger('transaction_hooks')
+
+
+def defer_commit_hooks():
+    """Defer the hooks of transactions committed on any connection."""
+    for connection in connections.all():
+        if hasattr(connection, 'defer_commit_hooks'):
+            connection.defer_commit_hooks()
+
+
+def run_deferred_commit_hooks():
+    """
+    Run the hooks deferred on each connection, logging (rather than raising)
+    any errors.
+
+    """
+    for connection in connections.all():
+        if getattr(connection, 'commit_hooks_deferred', None) is None:
+            continue
+        try:
+            connection.run_deferred_commit_hooks()
+        except Exception:
+            logger.exception(
+                "Error running deferred on-commit hooks on %r",
+                connection.alias)
+
+
+class DeferredHooksCloser(object):
+    """Runs the deferred hooks when the response it's attached to closes."""
+    def close(self):
+        run_deferred_commit_hooks()
+
+
+class DeferCommitHooksMiddleware(object):
+    """
+    Defer hooks committed during a request until its response is closed.
+
+    Put it first in ``MIDDLEWARE_CLASSES``, so that it covers transactions
+    committed by other middleware.
+
+    """
+    def process_request(self, request):
+        # hooks left over from a request whose response was never closed
+        run_deferred_commit_hooks()
+        defer_commit_hooks()
+
+    def process_response(self, request, response):
+        # closed, by the WSGI server, after the body has been sent; Django
+        # closes the database connections afterwards
+        response._closable_objects.append(DeferredHooksCloser())
+        return response
+
+
+class DeferCommitHooksWSGIMiddleware(object):
+    """
+    Wrap a WSGI application to defer hooks committed while it handles a
+    request until the server closes the response.
+
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        run_deferred_commit_hooks()
+        defer_commit_hooks()
+        try:
+            result = self.application(environ, start_response)
+        except Exception:
+            run_deferred_commit_hooks()
+            raise
+        return ClosingIterable(result)
+
+
+class ClosingIterable(object):
+    """A WSGI response body that runs the deferred hooks when closed."""
+    def __init__(self, result):
+        self.result = result
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            run_deferred_commit_hooks()
@@ -1,3 +1,59 @@
+from collections import deque
+import logging
+import sys
+import timeit
+import traceback
+from types import FunctionType
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.transaction import TransactionManagementError
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from transaction_hooks import (
+    aio, budget, debounce, errors, executors, profiling)
+from transaction_hooks.aio import CO_ASYNC
+from transaction_hooks.hooks import (
+    AsyncCommitHook, BatchCommitHook, CallCommitHook, CommitHook,
+    ExecutorCommitHook, KeyedCommitHook, PriorityCommitHook,
+    ProfiledCommitHook)
+from transaction_hooks.spill import SpillableQueue
+from transaction_hooks.metrics import (
+    CommitHookStats, hook_identity, hook_name)
+
+
+logger = logging.getLogger('transaction_hooks')
+
+# connection attributes that, when set, apply to every hook registered
+PER_HOOK_SETTINGS = (
+    'commit_hook_default_executor', 'commit_hook_outbox',
+    'commit_hook_storm_threshold', 'commit_hook_profile',
+    'commit_hook_stats_sink')
+
+
+class PerHookSetting(object):
+    """
+    A connection attribute in ``PER_HOOK_SETTINGS``. Setting it also updates
+    ``commit_hook_plain``, whether none of them is set, so that ``on_commit``
+    can check that with one lookup.
+
+    """
+    def __init__(self, name):
+        self.key = '_' + name
+
+    def __get__(self, connection, owner=None):
+        if connection is None:
+            return self
+        return connection.__dict__[self.key]
+
+    def __set__(self, connection, value):
+        attrs = connection.__dict__
+        attrs[self.key] = value
+        attrs['commit_hook_plain'] = not any(
+            attrs.get('_' + name) for name in PER_HOOK_SETTINGS)
+
+
 class TransactionHooksDatabaseWrapperMixin(object):
     """
     A ``DatabaseWrapper`` mixin to implement transaction-committed hooks.
@@ -11,37 +67,675 @@ class TransactionHooksDatabaseWrapperMixin(object):
     For an example, see ``backends/postgresql_psycopg2/base.py``.
 
     """
+    commit_hook_default_executor = PerHookSetting(
+        'commit_hook_default_executor')
+    commit_hook_outbox = PerHookSetting('commit_hook_outbox')
+    commit_hook_storm_threshold = PerHookSetting(
+        'commit_hook_storm_threshold')
+    commit_hook_profile = PerHookSetting('commit_hook_profile')
+    commit_hook_stats_sink = PerHookSetting('commit_hook_stats_sink')
+
     def __init__(self, *a, **kw):
-        # a list of no-argument functions to run when the transaction commits;
-        # each entry is an (sids, func) tuple, where sids is a list of the
-        # active savepoint IDs when this function was registered
-        self.run_on_commit = []
+        # once this many hooks are pending in memory, write them to a
+        # temporary file (see SpillableQueue); None to never do so
+        self.commit_hook_spill_threshold = getattr(
+            settings, 'TRANSACTION_HOOKS_SPILL_THRESHOLD', None)
+        # a queue of no-argument functions to run when the transaction commits
+        self.run_on_commit = self._new_commit_hook_queue()
+        # a queue of no-argument functions to run just before the transaction
+        # commits, still inside it
+        self.run_before_commit = deque()
+        # a stack of (sid, index, before_index) tuples, one for each active
+        # savepoint, where index and before_index are the lengths of
+        # run_on_commit and run_before_commit when the savepoint was created;
+        # rolling back to sid discards every hook from those indexes onwards
+        self.savepoint_hook_marks = []
+        # maps each deduplication key used in the current transaction to the
+        # list of live KeyedCommitHooks registered with it, oldest first
+        self.commit_hook_keys = {}
+        # maps each handler passed to on_commit_batch in the current
+        # transaction to the BatchCommitHook collecting its items
+        self.commit_hook_batches = {}
+        # maps each executor name used by hooks in the current transaction to
+        # the list of those hooks that have run (i.e. are ready to submit)
+        self.commit_hook_dispatch = {}
+        # the AsyncHookGroup tracking coroutine hooks from the current
+        # transaction, created when first needed
+        self.commit_hook_async_group = None
+        # name of the executor (in TRANSACTION_HOOKS_EXECUTORS) that hooks
+        # run in by default, or None to run them on the committing thread
+        self.commit_hook_default_executor = getattr(
+            settings, 'TRANSACTION_HOOKS_DEFAULT_EXECUTOR', None)
+        # has a hook with a non-default priority been registered in the
+        # current transaction (so the queue must be reordered before running)?
+        self.commit_hook_priorities = False
+        # should hooks be saved to the outbox table (see
+        # transaction_hooks.outbox) rather than kept in memory, by default?
+        self.commit_hook_outbox = getattr(
+            settings, 'TRANSACTION_HOOKS_OUTBOX', False)
+        # Which registration runs when the same key is registered repeatedly
+        # in one transaction: 'first' or 'last'
+        self.commit_hook_key_wins = getattr(
+            settings, 'TRANSACTION_HOOKS_KEY_WINS', 'first')
+        if self.commit_hook_key_wins not in ('first', 'last'):
+            raise ImproperlyConfigured(
+                "TRANSACTION_HOOKS_KEY_WINS must be 'first' or 'last'.")
+        # a callable to pass the CommitHookStats of each transaction to, or
+        # None to not collect them
+        sink = getattr(settings, 'TRANSACTION_HOOKS_STATS_SINK', None)
+        if isinstance(sink, six.string_types):
+            sink = import_string(sink)
+        self.commit_hook_stats_sink = sink
+        # the CommitHookStats for the current transaction, created when first
+        # needed, if a sink is configured
+        self.commit_hook_stats = None
+        # should the rest of a transaction's hooks run after one fails, with
+        # the failures reported to commit_hook_error_handler (if set, else
+        # raised as CommitHookErrors), or retried if commit_hook_retry?
+        self.commit_hook_isolate_errors = getattr(
+            settings, 'TRANSACTION_HOOKS_ISOLATE_ERRORS', False)
+        self.commit_hook_error_handler = errors.get_error_handler()
+        self.commit_hook_retry = bool(
+            getattr(settings, 'TRANSACTION_HOOKS_RETRY', None))
+        # warn (or, if strict, raise) when the same hook is registered more
+        # than this many times in one transaction; None to not count them
+        self.commit_hook_storm_threshold = getattr(
+            settings, 'TRANSACTION_HOOKS_STORM_THRESHOLD', None)
+        self.commit_hook_storm_strict = getattr(
+            settings, 'TRANSACTION_HOOKS_STORM_STRICT', False)
+        # maps the hook_identity of each hook registered in the current
+        # transaction to how many times it was, if counting
+        self.commit_hook_counts = {}
+        # how to group hooks in the hook profile (see
+        # transaction_hooks.profiling): 'callsite', 'qualname', or None to not
+        # profile them
+        self.commit_hook_profile = getattr(
+            settings, 'TRANSACTION_HOOKS_PROFILE', None)
+        if self.commit_hook_profile not in ('callsite', 'qualname', None):
+            raise ImproperlyConfigured(
+                "TRANSACTION_HOOKS_PROFILE must be 'callsite', 'qualname' or "
+                "None.")
+        # how long hooks may run on the committing thread per transaction,
+        # and where the rest run (see transaction_hooks.budget); None for no
+        # limit
+        self.commit_hook_budget = budget.get_config(getattr(
+            settings, 'TRANSACTION_HOOKS_LATENCY_BUDGET', None))
+        if (self.commit_hook_budget is not None and
+                self.commit_hook_budget['EXECUTOR'] not in getattr(
+                    settings, 'TRANSACTION_HOOKS_EXECUTORS', {})):
+            raise ImproperlyConfigured(
+                "The EXECUTOR of TRANSACTION_HOOKS_LATENCY_BUDGET, %r, isn't "
+                "in TRANSACTION_HOOKS_EXECUTORS." %
+                self.commit_hook_budget['EXECUTOR'])
+        # while hooks are deferred (see defer_commit_hooks), a list of the
+        # pending hook state of each committed transaction whose hooks haven't
+        # run yet; otherwise None
+        self.commit_hooks_deferred = None
         # Should we run the on-commit hooks the next time set_autocommit(True)
         # is called?
         self.run_commit_hooks_on_set_autocommit_on = False
 
         super(TransactionHooksDatabaseWrapperMixin, self).__init__(*a, **kw)
 
-    def on_commit(self, func):
+    def on_commit(self, func, key=None, executor=None, priority=0,
+                  outbox=None, debounce_key=None, window=None):
+        if (self.in_atomic_block and key is None and executor is None and
+                not priority and outbox is None and debounce_key is None and
+                self.commit_hook_plain and func.__class__ is FunctionType and
+                not func.__code__.co_flags & CO_ASYNC):
+            # the common case: a plain function, with no options or settings
+            # that apply to every hook; just queue it
+            self.run_on_commit.append(func)
+            return
+        if debounce_key is not None:
+            # runs on the debouncer's thread, not in an executor or the outbox
+            self._add_commit_hook(
+                debounce.DebouncedCommitHook(func, debounce_key, window),
+                key=key, executor=False, priority=priority, outbox=False,
+                is_async=False)
+            return
+        self._add_commit_hook(
+            func, key=key, executor=executor, priority=priority, outbox=outbox,
+            is_async=aio.is_async_hook(func))
+
+    def on_commit_async(self, func, key=None, priority=0):
+        """
+        Schedule ``func()`` (a function returning an awaitable), or the
+        awaitable ``func``, on the event loop when the transaction commits.
+
+        ``on_commit`` recognises coroutine functions and awaitables itself;
+        this is for other functions that return an awaitable, such as those
+        wrapped by ``asyncio.coroutine``.
+
+        """
+        self._add_commit_hook(
+            func, key=key, executor=False, priority=priority, outbox=False,
+            is_async=True)
+
+    def on_commit_call(self, func, *args):
+        """
+        Call ``func(*args)`` when the transaction commits.
+
+        Equivalent to ``on_commit(lambda: func(*args))``, but stores only
+        ``func`` and ``args`` in a small record, rather than a closure that
+        keeps alive everything in scope where it was created. Such hooks can
+        be written out by a ``SpillableQueue``, and saved to the outbox.
+
+        """
+        self._add_commit_hook(
+            CallCommitHook(func, args), key=None, executor=None, priority=0,
+            outbox=None, is_async=False)
+
+    def on_before_commit(self, func):
+        """
+        Call ``func()`` just before the transaction commits, inside it.
+
+        Hooks run in registration order when the outermost atomic block exits
+        (or ``commit()`` is called), so they can make further queries in the
+        transaction, for instance to write rows gathered during it in one bulk
+        statement. If a hook raises, the transaction is rolled back and the
+        exception propagates. Outside a transaction, ``func()`` is called
+        immediately.
+
+        """
+        if self.in_atomic_block:
+            self.run_before_commit.append(func)
+        else:
+            func()
+
+    def on_commit_many(self, funcs):
+        """
+        Register each of ``funcs`` as if with ``on_commit``, in order.
+
+        The hooks are added to the queue in one step, which is much cheaper
+        per hook than calling ``on_commit`` for each. They take no options;
+        coroutine functions must be registered with ``on_commit``.
+
+        """
+        if (self.commit_hook_default_executor or self.commit_hook_outbox or
+                self.commit_hook_profile):
+            # each hook needs wrapping or saving as on_commit would
+            for func in funcs:
+                self.on_commit(func)
+            return
+        if not self.in_atomic_block:
+            for func in funcs:
+                func()
+            return
+        pending = self.run_on_commit
+        count = len(pending)
+        pending.extend(funcs)
+        if self.commit_hook_stats_sink is not None:
+            stats = self._hook_stats()
+            stats.registered += len(pending) - count
+            stats.peak_pending = max(stats.peak_pending, len(pending))
+
+    def on_commit_call_many(self, func, args_list):
+        """
+        Call ``func(*args)`` for each ``args`` in ``args_list`` when the
+        transaction commits, as with ``on_commit_call``, registering them all
+        in one step.
+
+        """
+        self.on_commit_many(CallCommitHook(func, args) for args in args_list)
+
+    def _add_commit_hook(self, func, key, executor, priority, outbox,
+                         is_async):
+        if outbox is None:
+            outbox = self.commit_hook_outbox
+        if outbox:
+            # saved as part of the transaction, or right away if there's none;
+            # the relay_commit_hooks command runs it later
+            from transaction_hooks.outbox.relay import save_hook
+            save_hook(func, using=self.alias)
+            return
+        if executor is None:
+            executor = self.commit_hook_default_executor
         if self.in_atomic_block:
             # transaction in progress; save for execution on commit
-            self.run_on_commit.append((self.savepoint_ids[:], func))
+            if self.commit_hook_storm_threshold and key is None:
+                self._count_hook_registration(func)
+            if is_async:
+                func = AsyncCommitHook(func, self.async_commit_hooks())
+            elif executor:
+                func = self._executor_hook(func, executor)
+            if key is not None:
+                keyed = self._register_keyed_hook(func, key)
+                if keyed is None:
+                    if self.commit_hook_profile:
+                        self._profiled_hook(func).discard(self)
+                    return
+                func = keyed
+            if self.commit_hook_profile:
+                func = self._profiled_hook(func)
+            if priority:
+                func = PriorityCommitHook(func, priority)
+                self.commit_hook_priorities = True
+            self.run_on_commit.append(func)
+            if self.commit_hook_stats_sink is not None:
+                self._record_registered_hook()
+        elif is_async:
+            # no transaction in progress; schedule immediately
+            aio.schedule(
+                func() if callable(func) else func, aio.get_event_loop())
+        elif executor:
+            # no transaction in progress; submit immediately
+            self._check_executor_hook(func, executor)
+            executors.submit_hooks(executor, [func])
         else:
             # no transaction in progress; execute immediately
             func()
 
+    def on_commit_batch(self, handler, item):
+        """
+        Collect ``item`` to be passed to ``handler`` after commit.
+
+        ``handler`` is called once per transaction, with a list of all the
+        items registered for it (in order), at the point where its first item
+        was registered. Items registered under a savepoint that is rolled back
+        are left out. Outside a transaction, ``handler([item])`` is called
+        immediately.
+
+        """
+        if not self.in_atomic_block:
+            handler([item])
+            return
+        hook = self.commit_hook_batches.get(handler)
+        if hook is None:
+            hook = self.commit_hook_batches[handler] = BatchCommitHook(handler)
+        hook.items.append(item)
+        self.run_on_commit.append(hook)
+        if self.commit_hook_stats_sink is not None:
+            self._record_registered_hook()
+
+    def on_commit_submit(self, executor, func, *args, **kwargs):
+        """
+        Submit ``func(*args, **kwargs)`` to ``executor`` (a name in
+        ``TRANSACTION_HOOKS_EXECUTORS``) when the transaction commits, and
+        return a ``concurrent.futures.Future`` for its result.
+
+        Unlike hooks registered with ``on_commit(executor=...)``, each call
+        is a task of its own, so a transaction's calls can run in parallel. If
+        the hook is discarded, e.g. by a rollback, the future is cancelled.
+        Outside a transaction, the call is submitted immediately.
+
+        """
+        bounded = executors.get_executor(executor)
+        executors.check_picklable(bounded, func, args, kwargs)
+        hook = executors.SubmitCommitHook(func, args, kwargs, bounded)
+        if self.in_atomic_block:
+            self.run_on_commit.append(hook)
+            if self.commit_hook_stats_sink is not None:
+                self._record_registered_hook()
+        else:
+            hook()
+        return hook.future
+
+    def _new_commit_hook_queue(self):
+        if self.commit_hook_spill_threshold:
+            return SpillableQueue(self.commit_hook_spill_threshold)
+        return deque()
+
+    def _hook_stats(self):
+        if self.commit_hook_stats is None:
+            self.commit_hook_stats = CommitHookStats(self.alias)
+        return self.commit_hook_stats
+
+    def _record_registered_hook(self):
+        stats = self._hook_stats()
+        stats.registered += 1
+        stats.peak_pending = max(stats.peak_pending, len(self.run_on_commit))
+
+    def _send_hook_stats(self):
+        stats, self.commit_hook_stats = self.commit_hook_stats, None
+        if stats is not None:
+            self.commit_hook_stats_sink(stats)
+
+    def async_commit_hooks(self):
+        """
+        Return the ``AsyncHookGroup`` for the current transaction, which can
+        be awaited (via its ``wait()`` method) for all the coroutine hooks
+        registered in the transaction to finish after it commits.
+
+        """
+        if not self.in_atomic_block:
+            raise TransactionManagementError(
+                "async_commit_hooks() requires an active transaction.")
+        if self.commit_hook_async_group is None:
+            self.commit_hook_async_group = aio.AsyncHookGroup(
+                aio.get_event_loop())
+        return self.commit_hook_async_group
+
+    def _check_executor_hook(self, func, executor):
+        # fail at registration, rather than after commit, if misconfigured or
+        # if func can't be sent to a process pool
+        executors.check_picklable(
+            executors.get_executor(executor), func, (), {})
+
+    def _executor_hook(self, func, executor):
+        self._check_executor_hook(func, executor)
+        dispatched = self.commit_hook_dispatch.get(executor)
+        if dispatched is None:
+            dispatched = self.commit_hook_dispatch[executor] = []
+        return ExecutorCommitHook(func, dispatched)
+
+    def _count_hook_registration(self, func):
+        identity = hook_identity(func)
+        count = self.commit_hook_counts.get(identity, 0) + 1
+        self.commit_hook_counts[identity] = count
+        if count != self.commit_hook_storm_threshold + 1:
+            return
+        message = (
+            "%s was registered more than %d times in one transaction on %r; "
+            "register such hooks in bulk with on_commit_call_many or "
+            "on_commit_batch, or deduplicate them with a key." % (
+                hook_name(func), self.commit_hook_storm_threshold,
+                self.alias))
+        if self.commit_hook_storm_strict:
+            raise errors.HookStormError(message)
+        logger.warning("%s Registered at:\n%s", message, ''.join(
+            traceback.format_stack(sys._getframe(3))))
+
+    def _profiled_hook(self, func):
+        site = profiling.hook_site(self.commit_hook_profile, func)
+        profiling.profile.registered(site)
+        return ProfiledCommitHook(func, site, profiling.profile)
+
+    def _register_keyed_hook(self, func, key):
+        """
+        Return a ``KeyedCommitHook`` for ``func`` to queue, or ``None`` if an
+        earlier hook with the same ``key`` wins instead.
+
+        """
+        hook = KeyedCommitHook(func, key)
+        registered = self.commit_hook_keys.get(key)
+        if registered is None:
+            self.commit_hook_keys[key] = [hook]
+        elif self.commit_hook_key_wins == 'first':
+            return None
+        else:
+            registered[-1].superseded = True
+            registered.append(hook)
+        return hook
+
     def run_and_clear_commit_hooks(self):
         self.validate_no_atomic_block()
+        if self.commit_hooks_deferred is not None and self.run_on_commit:
+            self._defer_commit_hooks()
+            return
+        # superseded keyed hooks are already flagged and batches hold their
+        # own items; any hooks registered from here on belong to a new
+        # transaction
+        self.commit_hook_keys = {}
+        self.commit_hook_batches = {}
+        self.commit_hook_counts = {}
+        dispatch, self.commit_hook_dispatch = self.commit_hook_dispatch, {}
+        group, self.commit_hook_async_group = (
+            self.commit_hook_async_group, None)
+        if self.commit_hook_priorities:
+            self._order_commit_hooks_by_priority()
+        failures = [] if self.commit_hook_isolate_errors else None
         try:
-            while self.run_on_commit:
-                sids, func = self.run_on_commit.pop(0)
+            if self.commit_hook_budget is not None:
+                self._run_commit_hooks_within_budget(
+                    self.commit_hook_budget, self.commit_hook_stats, failures)
+            elif self.commit_hook_stats is not None:
+                self._run_and_time_commit_hooks(
+                    self.commit_hook_stats, failures)
+            elif failures is not None:
+                self._run_commit_hooks_isolated(failures)
+            else:
+                while self.run_on_commit:
+                    func = self.run_on_commit.popleft()
+                    func()
+        finally:
+            self.clear_commit_hooks('discarded_error')
+            # hooks bound for executors that were reached before any error
+            # are submitted, one task per executor to keep them in order
+            for executor, funcs in dispatch.items():
+                if funcs:
+                    executors.submit_hooks(executor, funcs)
+            if group is not None:
+                group.close()
+        if failures:
+            self._handle_commit_hook_failures(failures)
+
+    def defer_commit_hooks(self):
+        """
+        Hold on to the hooks of transactions committed from now on, rather
+        than running them, until ``run_deferred_commit_hooks()`` is called.
+
+        """
+        if self.commit_hooks_deferred is None:
+            self.commit_hooks_deferred = []
+
+    def run_deferred_commit_hooks(self):
+        """
+        Stop deferring hooks, and run those deferred so far.
+
+        Each transaction's hooks run as they would have right after it
+        committed: in priority order, stopping at the first one that raises.
+        The hooks of later transactions still run; the first error is then
+        re-raised.
+
+        """
+        # stop deferring first, even inside an atomic block (as when the test
+        # client closes a response inside TestCase's transaction), so that
+        # later commits on this connection run their hooks
+        deferred, self.commit_hooks_deferred = self.commit_hooks_deferred, None
+        if not deferred:
+            return
+        self.validate_no_atomic_block()
+        error = None
+        for state in deferred:
+            (self.run_on_commit, self.commit_hook_priorities,
+             self.commit_hook_dispatch, self.commit_hook_async_group,
+             self.commit_hook_stats) = state
+            try:
+                self.run_and_clear_commit_hooks()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            six.reraise(*error)
+
+    def _defer_commit_hooks(self):
+        self.commit_hooks_deferred.append((
+            self.run_on_commit, self.commit_hook_priorities,
+            self.commit_hook_dispatch, self.commit_hook_async_group,
+            self.commit_hook_stats))
+        self.run_on_commit = self._new_commit_hook_queue()
+        self.commit_hook_dispatch = {}
+        self.commit_hook_async_group = None
+        self.commit_hook_stats = None
+        # nothing left to discard; just reset the per-transaction state
+        self.clear_commit_hooks()
+
+    def _order_commit_hooks_by_priority(self):
+        """
+        Reorder the pending hooks so that higher priorities run first, keeping
+        registration order within each priority.
+
+        """
+        self.commit_hook_priorities = False
+        pending = self.run_on_commit
+        tiers = {}
+        while pending:
+            func = pending.popleft()
+            if func.__class__ is PriorityCommitHook:
+                priority = func.priority
+            else:
+                priority = 0
+            tier = tiers.get(priority)
+            if tier is None:
+                tier = tiers[priority] = self._new_commit_hook_queue()
+            tier.append(func)
+        for priority in sorted(tiers, reverse=True):
+            tier = tiers.pop(priority)
+            while tier:
+                pending.append(tier.popleft())
+
+    def _run_commit_hooks_isolated(self, failures):
+        """
+        Run the pending hooks, appending ``(hook, exc_info)`` to ``failures``
+        for each one that raises.
+
+        """
+        pending = self.run_on_commit
+        while pending:
+            func = pending.popleft()
+            try:
                 func()
+            except Exception:
+                failures.append((func, sys.exc_info()))
+
+    def _handle_commit_hook_failures(self, failures):
+        errors.handle_failures(
+            failures, self.commit_hook_retry, self.commit_hook_error_handler)
+
+    def _run_and_time_commit_hooks(self, stats, failures=None):
+        timer = timeit.default_timer
+        committed_at = stats.committed_at
+        while self.run_on_commit:
+            func = self.run_on_commit.popleft()
+            start = timer()
+            try:
+                func()
+            except Exception:
+                if failures is None:
+                    raise
+                failures.append((func, sys.exc_info()))
+            finally:
+                stats.executed += 1
+                stats.hook_timings.append((
+                    hook_name(func),
+                    start - committed_at if committed_at is not None else 0.0,
+                    timer() - start,
+                ))
+
+    def _run_commit_hooks_within_budget(self, config, stats=None,
+                                        failures=None):
+        timer = timeit.default_timer
+        committed_at = stats.committed_at if stats is not None else None
+        deadline = timer() + config['BUDGET']
+        slow_hook = config['SLOW_HOOK']
+        # hooks sent to the budget executor, in the order they were reached
+        background = []
+        try:
+            while self.run_on_commit:
+                func = self.run_on_commit.popleft()
+                name = None
+                if not budget.is_dispatcher(func):
+                    name = hook_name(func)
+                    if timer() >= deadline or budget.is_slow(name, slow_hook):
+                        background.append(func)
+                        continue
+                start = timer()
+                try:
+                    func()
+                except Exception:
+                    if failures is None:
+                        raise
+                    failures.append((func, sys.exc_info()))
+                finally:
+                    duration = timer() - start
+                    if name is not None:
+                        budget.learn(name, duration)
+                    if stats is not None:
+                        stats.executed += 1
+                        stats.hook_timings.append((
+                            name or hook_name(func),
+                            start - committed_at
+                            if committed_at is not None else 0.0,
+                            duration,
+                        ))
         finally:
-            self.run_on_commit = []
+            if background:
+                if stats is not None:
+                    stats.handed_off += len(background)
+                # with the same error handling as on the committing thread
+                budget.submit_hooks(
+                    config['EXECUTOR'], background,
+                    isolate=failures is not None,
+                    retry=self.commit_hook_retry,
+                    error_handler=self.commit_hook_error_handler)
+
+    def run_before_commit_hooks(self):
+        """
+        Run the pending before-commit hooks, oldest first, including any they
+        register in turn.
+
+        """
+        # the hooks run as if still inside the outermost atomic block, so that
+        # they can use atomic() (as most ORM writes do), and their own hooks
+        # are queued rather than run immediately
+        in_atomic_block, self.in_atomic_block = self.in_atomic_block, True
+        try:
+            pending = self.run_before_commit
+            while pending:
+                func = pending.popleft()
+                func()
+        except Exception:
+            self.in_atomic_block = in_atomic_block
+            self.rollback()
+            raise
+        self.in_atomic_block = in_atomic_block
+        if self.needs_rollback:
+            # a hook caught an error from inside an atomic block with
+            # savepoint=False, so the transaction can't commit
+            self.rollback()
+            raise TransactionManagementError(
+                "A before-commit hook left the transaction needing rollback.")
+
+    def _discard_commit_hooks(self, index=0):
+        """
+        Discard pending hooks from position ``index`` onwards, newest first,
+        and return how many there were.
+
+        """
+        pending = self.run_on_commit
+        count = len(pending) - index
+        while len(pending) > index:
+            func = pending.pop()
+            if isinstance(func, CommitHook):
+                func.discard(self)
+        return count
+
+    def clear_commit_hooks(self, reason='discarded_connection'):
+        """
+        Discard all pending hooks and reset per-transaction state.
+
+        ``reason`` is the ``CommitHookStats`` counter to add the discarded
+        hooks to.
+
+        """
+        discarded = self._discard_commit_hooks()
+        self.run_before_commit.clear()
+        if self.commit_hook_stats is not None:
+            stats = self.commit_hook_stats
+            setattr(stats, reason, getattr(stats, reason) + discarded)
+            self._send_hook_stats()
+        self.savepoint_hook_marks = []
+        self.commit_hook_priorities = False
+        self.commit_hook_keys = {}
+        self.commit_hook_batches = {}
+        self.commit_hook_counts = {}
+        self.commit_hook_dispatch = {}
+        if self.commit_hook_async_group is not None:
+            self.commit_hook_async_group.close()
+            self.commit_hook_async_group = None
 
     def commit(self, *a, **kw):
+        if self.run_before_commit:
+            # as commit() itself would, refuse to commit inside atomic()
+            # before the hooks can make any queries
+            self.validate_no_atomic_block()
+            self.run_before_commit_hooks()
         super(TransactionHooksDatabaseWrapperMixin, self).commit(*a, **kw)
 
+        if self.commit_hook_stats is not None:
+            self.commit_hook_stats.committed_at = timeit.default_timer()
+
         # Atomic has not had a chance yet to restore autocommit on this
         # connection, so on databases that handle autocommit correctly, we need
         # to wait to run the hooks until it calls set_autocommit(True)
@@ -58,25 +752,59 @@ class TransactionHooksDatabaseWrapperMixin(object):
             self.run_and_clear_commit_hooks()
             self.run_commit_hooks_on_set_autocommit_on = False
 
+    def savepoint(self, *a, **kw):
+        sid = super(TransactionHooksDatabaseWrapperMixin, self).savepoint(
+            *a, **kw)
+
+        if sid is not None:
+            self.savepoint_hook_marks.append(
+                (sid, len(self.run_on_commit), len(self.run_before_commit)))
+        return sid
+
+    def savepoint_commit(self, sid, *a, **kw):
+        super(TransactionHooksDatabaseWrapperMixin, self).savepoint_commit(
+            sid, *a, **kw)
+
+        # hooks registered under a released savepoint now belong to the
+        # enclosing savepoint (or transaction), whose mark already covers them
+        marks = self.savepoint_hook_marks
+        for i in range(len(marks) - 1, -1, -1):
+            if marks[i][0] == sid:
+                del marks[i]
+                break
+
     def savepoint_rollback(self, sid, *a, **kw):
         super(TransactionHooksDatabaseWrapperMixin, self).savepoint_rollback(
             sid, *a, **kw)
 
-        # remove any callbacks registered while this savepoint was active
-        self.run_on_commit = list(filter(
-            lambda x: sid not in x[0], self.run_on_commit))
+        # remove any callbacks registered while this savepoint was active,
+        # along with the marks of any savepoints nested inside it
+        marks = self.savepoint_hook_marks
+        for i in range(len(marks) - 1, -1, -1):
+            if marks[i][0] == sid:
+                _, index, before_index = marks[i]
+                del marks[i:]
+                break
+        else:
+            return
+        before = self.run_before_commit
+        while len(before) > before_index:
+            before.pop()
+        discarded = self._discard_commit_hooks(index)
+        if self.commit_hook_stats is not None:
+            self.commit_hook_stats.discarded_savepoint_rollback += discarded
 
     def rollback(self, *a, **kw):
         super(TransactionHooksDatabaseWrapperMixin, self).rollback(*a, **kw)
 
-        self.run_on_commit = []
+        self.clear_commit_hooks('discarded_rollback')
 
     def connect(self, *a, **kw):
         super(TransactionHooksDatabaseWrapperMixin, self).connect(*a, **kw)
 
-        self.run_on_commit = []
+        self.clear_commit_hooks()
 
     def close(self, *a, **kw):
         super(TransactionHooksDatabaseWrapperMixin, self).close(*a, **kw)
 
-        self.run_on_commit = []
+        self.clear_commit_hooks()
@@ -0,0 +1 @@
+default_app_config = 'transaction_hooks.outbox.apps.OutboxConfig'
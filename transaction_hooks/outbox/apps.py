@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class OutboxConfig(AppConfig):
+    name = 'transaction_hooks.outbox'
+    label = 'transaction_hooks_outbox'
+    verbose_name = 'Transaction hooks outbox'
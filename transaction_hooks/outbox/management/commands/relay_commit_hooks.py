@@ -0,0 +1,81 @@
+from optparse import make_option
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from transaction_hooks.outbox.relay import relay_batch, requeue_hooks
+
+
+class Command(BaseCommand):
+    help = "Run on-commit hooks saved to the outbox, in batches."
+
+    if django.VERSION < (1, 8):
+        option_list = BaseCommand.option_list + (
+            make_option('--database', default=DEFAULT_DB_ALIAS),
+            make_option('--batch-size', type='int', default=100),
+            make_option('--max-attempts', type='int', default=5),
+            make_option('--loop', action='store_true', default=False),
+            make_option('--interval', type='float', default=1.0),
+            make_option('--backoff', type='float', default=1.0),
+            make_option('--max-backoff', type='float', default=300.0),
+            make_option('--requeue', action='store_true', default=False),
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help="Database whose outbox to relay. Defaults to 'default'.")
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Hooks to run per transaction. Defaults to 100.")
+        parser.add_argument(
+            '--max-attempts', type=int, default=5,
+            help="Leave hooks that have failed this many times. Defaults "
+            "to 5.")
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help="Keep relaying, rather than stopping once the outbox is "
+            "empty.")
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help="With --loop, seconds to wait when the outbox is empty, or "
+            "every hook in a batch failed. Defaults to 1.")
+        parser.add_argument(
+            '--backoff', type=float, default=1.0,
+            help="Seconds before retrying a hook after its first failure, "
+            "doubling after each failure after that. Defaults to 1.")
+        parser.add_argument(
+            '--max-backoff', type=float, default=300.0,
+            help="Longest wait before retrying a hook. Defaults to 300.")
+        parser.add_argument(
+            '--requeue', action='store_true', default=False,
+            help="First give hooks that have failed --max-attempts times "
+            "another --max-attempts tries.")
+
+    def handle(self, **options):
+        if options['requeue']:
+            requeued = requeue_hooks(
+                using=options['database'],
+                max_attempts=options['max_attempts'])
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write("Requeued %d hooks." % requeued)
+        total = 0
+        while True:
+            tried, succeeded = relay_batch(
+                using=options['database'],
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                backoff=options['backoff'],
+                max_backoff=options['max_backoff'],
+            )
+            total += succeeded
+            # stop (or wait) once no hooks are due, or none of them succeeded
+            # (e.g. a service they call is down), rather than spinning
+            if tried < options['batch_size'] or not succeeded:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        if int(options.get('verbosity', 1)) > 1:
+            self.stdout.write("Relayed %d hooks." % total)
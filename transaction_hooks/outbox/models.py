@@ -0,0 +1,27 @@
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+
+
+@python_2_unicode_compatible
+class OutboxHook(models.Model):
+    """
+    An on-commit hook saved in the same transaction that registered it, to be
+    run later by the ``relay_commit_hooks`` management command.
+
+    """
+    # dotted import path of the function to call
+    func = models.CharField(max_length=255)
+    # JSON-encoded {"args": [...], "kwargs": {...}}
+    arguments = models.TextField(default='{}')
+    created = models.DateTimeField(auto_now_add=True)
+    # failed attempts to run it so far, and the last error
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # when it may be retried after a failure, or None if it may run now
+    next_attempt = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "%s (%s)" % (self.func, self.pk)
@@ -0,0 +1,149 @@
+"""
+Save on-commit hooks to the outbox table, and run them from it.
+
+A hook can only be saved if it can be found again by import path: a
+module-level function, optionally wrapped in ``functools.partial`` (or
+registered with ``on_commit_call``) with JSON-serializable arguments.
+
+"""
+from datetime import timedelta
+import functools
+import json
+import logging
+import traceback
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from transaction_hooks.hooks import CallCommitHook
+from transaction_hooks.outbox.models import OutboxHook
+
+
+logger = logging.getLogger('transaction_hooks')
+
+
+def serialize_hook(func):
+    """
+    Return the ``(func, arguments)`` fields to save ``func`` as, or raise
+    ``ValueError`` if it can't be saved.
+
+    """
+    args, kwargs = (), {}
+    if isinstance(func, functools.partial):
+        func, args, kwargs = func.func, func.args, func.keywords or {}
+    elif isinstance(func, CallCommitHook):
+        func, args = func.func, func.args
+    name = getattr(func, '__qualname__', None) or getattr(
+        func, '__name__', None)
+    path = '%s.%s' % (getattr(func, '__module__', None), name)
+    try:
+        found = import_string(path)
+    except ImportError:
+        found = None
+    if found is not func:
+        raise ValueError(
+            "Only module-level functions can be saved to the outbox; can't "
+            "import %r as %s." % (func, path))
+    try:
+        arguments = json.dumps(
+            {'args': list(args), 'kwargs': kwargs}, sort_keys=True)
+    except TypeError as exc:
+        raise ValueError("Can't save %r to the outbox: %s" % (func, exc))
+    return path, arguments
+
+
+def save_hook(func, using=DEFAULT_DB_ALIAS):
+    """Save ``func`` to the outbox, in the current transaction on ``using``."""
+    path, arguments = serialize_hook(func)
+    OutboxHook.objects.using(using).create(func=path, arguments=arguments)
+
+
+def run_hook(hook):
+    arguments = json.loads(hook.arguments)
+    import_string(hook.func)(*arguments['args'], **arguments['kwargs'])
+
+
+def claim_hooks(using, batch_size, max_attempts):
+    """
+    Lock and return up to ``batch_size`` hooks from the outbox, oldest first,
+    skipping any that already failed ``max_attempts`` times, or that aren't
+    due to be retried yet.
+
+    Must be called in a transaction. On PostgreSQL, rows locked by another
+    relay are skipped, so several relays can work in parallel; elsewhere they
+    wait for each other.
+
+    """
+    connection = connections[using]
+    now = timezone.now()
+    hooks = OutboxHook.objects.using(using).filter(
+        Q(next_attempt__isnull=True) | Q(next_attempt__lte=now),
+        attempts__lt=max_attempts)
+    table = connection.ops.quote_name(OutboxHook._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT id FROM %s WHERE attempts < %%s AND "
+                "(next_attempt IS NULL OR next_attempt <= %%s) ORDER BY id "
+                "LIMIT %%s FOR UPDATE SKIP LOCKED" % table,
+                [max_attempts, now, batch_size])
+            ids = [row[0] for row in cursor.fetchall()]
+            return list(hooks.filter(pk__in=ids))
+        if connection.vendor == 'sqlite':
+            # SQLite has no row locks; any write takes the lock on the whole
+            # database until the transaction ends, so relays take turns
+            cursor.execute("UPDATE %s SET attempts = attempts WHERE 0 = 1"
+                           % table)
+            return list(hooks[:batch_size])
+    return list(hooks.select_for_update()[:batch_size])
+
+
+def relay_batch(using=DEFAULT_DB_ALIAS, batch_size=100, max_attempts=5,
+                backoff=1.0, max_backoff=300.0):
+    """
+    Run a batch of hooks from the outbox, in order, and return how many were
+    tried and how many succeeded.
+
+    Hooks that succeed are deleted. Each one runs in a savepoint, so that if
+    it raises, any database changes it made are rolled back; it is then kept
+    for a later batch, with its failure recorded, until it has failed
+    ``max_attempts`` times. It isn't retried for ``backoff`` seconds after
+    its first failure, twice as long after each one after that, up to
+    ``max_backoff``.
+
+    """
+    with transaction.atomic(using=using):
+        hooks = claim_hooks(using, batch_size, max_attempts)
+        done = []
+        for hook in hooks:
+            try:
+                with transaction.atomic(using=using):
+                    run_hook(hook)
+            except Exception:
+                logger.exception("Error running outbox hook %s", hook)
+                hook.attempts += 1
+                hook.last_error = traceback.format_exc()
+                hook.next_attempt = timezone.now() + timedelta(seconds=min(
+                    backoff * 2 ** (hook.attempts - 1), max_backoff))
+                hook.save(using=using, update_fields=[
+                    'attempts', 'last_error', 'next_attempt'])
+            else:
+                done.append(hook.pk)
+        # stay under SQLite's limit on query parameters
+        for start in range(0, len(done), 500):
+            OutboxHook.objects.using(using).filter(
+                pk__in=done[start:start + 500]).delete()
+    return len(hooks), len(done)
+
+
+def requeue_hooks(using=DEFAULT_DB_ALIAS, max_attempts=5):
+    """
+    Give hooks that have failed ``max_attempts`` times (and so are no longer
+    relayed) another ``max_attempts`` tries, starting now, and return how
+    many there were.
+
+    """
+    return OutboxHook.objects.using(using).filter(
+        attempts__gte=max_attempts).update(attempts=0, next_attempt=None)
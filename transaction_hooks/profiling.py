@@ -0,0 +1,199 @@
+"""
+Aggregate on-commit hook costs by where the hooks were registered.
+
+Profiling is off unless the ``TRANSACTION_HOOKS_PROFILE`` setting is
+``'callsite'`` (group hooks by the file, line and function that called
+``on_commit``) or ``'qualname'`` (group them by the hook function's name).
+Each hook registered in a transaction is then counted in ``profile``, the
+``HookProfile`` for this process, along with whether it was discarded and
+how long it took to run.
+
+If ``TRANSACTION_HOOKS_PROFILE_DIR`` is set, each process saves its profile
+to a JSON file in that directory (every ``SAVE_INTERVAL`` seconds while hooks
+are running, and at exit), and the ``commit_hook_profile`` management command
+reports the combined profiles of all of them.
+
+"""
+import atexit
+import json
+import os
+import sys
+import tempfile
+import threading
+import timeit
+
+from django.conf import settings
+
+from transaction_hooks.metrics import hook_name
+
+
+# save the profile at most this often, in seconds
+SAVE_INTERVAL = 10.0
+
+# the keys a report can be sorted by
+SORT_KEYS = ('total', 'max', 'mean', 'registered', 'discarded')
+
+# call sites are looked for outside this directory
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SiteProfile(object):
+    """The aggregate costs of the hooks registered at one site."""
+    __slots__ = ('registered', 'discarded', 'executed', 'total', 'max')
+
+    def __init__(self, registered=0, discarded=0, executed=0, total=0.0,
+                 max=0.0):
+        self.registered = registered
+        self.discarded = discarded
+        self.executed = executed
+        # seconds spent running hooks, in total and in the slowest one
+        self.total = total
+        self.max = max
+
+    @property
+    def mean(self):
+        return self.total / self.executed if self.executed else 0.0
+
+    @property
+    def discard_rate(self):
+        if not self.registered:
+            return 0.0
+        return float(self.discarded) / self.registered
+
+    def merge(self, other):
+        self.registered += other.registered
+        self.discarded += other.discarded
+        self.executed += other.executed
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def as_list(self):
+        return [self.registered, self.discarded, self.executed, self.total,
+                self.max]
+
+
+class HookProfile(object):
+    """Aggregate hook costs for each registration site, safe across threads."""
+    def __init__(self):
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.saved_at = timeit.default_timer()
+
+    def _site(self, site):
+        profile = self.sites.get(site)
+        if profile is None:
+            profile = self.sites[site] = SiteProfile()
+        return profile
+
+    def registered(self, site):
+        with self.lock:
+            self._site(site).registered += 1
+
+    def discarded(self, site):
+        with self.lock:
+            self._site(site).discarded += 1
+
+    def executed(self, site, duration):
+        with self.lock:
+            profile = self._site(site)
+            profile.executed += 1
+            profile.total += duration
+            if duration > profile.max:
+                profile.max = duration
+        if timeit.default_timer() - self.saved_at > SAVE_INTERVAL:
+            save()
+
+    def merge(self, other):
+        with self.lock:
+            for site, profile in other.sites.items():
+                self._site(site).merge(profile)
+
+    def clear(self):
+        with self.lock:
+            self.sites.clear()
+
+    def dumps(self):
+        with self.lock:
+            return json.dumps(dict(
+                (site, profile.as_list())
+                for site, profile in self.sites.items()))
+
+    @classmethod
+    def loads(cls, data):
+        profile = cls()
+        for site, values in json.loads(data).items():
+            profile.sites[site] = SiteProfile(*values)
+        return profile
+
+    def report(self, sort='total', limit=None):
+        """Return the report lines, costliest sites first."""
+        rows = sorted(
+            self.sites.items(),
+            key=lambda item: getattr(item[1], sort) if sort != 'discarded'
+            else item[1].discard_rate,
+            reverse=True)
+        if limit:
+            rows = rows[:limit]
+        lines = ['%10s %10s %10s %10s %10s  %s' % (
+            'registered', 'discarded', 'total ms', 'max ms', 'mean ms',
+            'site')]
+        for site, profile in rows:
+            lines.append('%10d %9.1f%% %10.1f %10.2f %10.2f  %s' % (
+                profile.registered, 100 * profile.discard_rate,
+                1000 * profile.total, 1000 * profile.max,
+                1000 * profile.mean, site))
+        return lines
+
+
+# the profile of this process
+profile = HookProfile()
+
+
+def call_site():
+    """The first caller outside this package, as ``file:line in function``."""
+    frame = sys._getframe(1)
+    while frame.f_back is not None and os.path.dirname(
+            os.path.abspath(frame.f_code.co_filename)) == PACKAGE_DIR:
+        frame = frame.f_back
+    return '%s:%d in %s' % (
+        frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+
+def hook_site(mode, func):
+    """Where ``func`` is being registered from, for the given profile mode."""
+    if mode == 'callsite':
+        return call_site()
+    return hook_name(func)
+
+
+def profile_dir():
+    return getattr(settings, 'TRANSACTION_HOOKS_PROFILE_DIR', None)
+
+
+def save():
+    """Save this process's profile to the profile directory, if set."""
+    profile.saved_at = timeit.default_timer()
+    if not profile.sites:
+        return
+    directory = profile_dir()
+    if not directory:
+        return
+    data = profile.dumps()
+    # written to a temporary file and renamed, so readers never see half of it
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(data)
+    os.rename(path, os.path.join(directory, '%d.json' % os.getpid()))
+
+
+def load(directory):
+    """Return the combined profile of all processes saved in ``directory``."""
+    combined = HookProfile()
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as f:
+                combined.merge(HookProfile.loads(f.read()))
+    return combined
+
+
+atexit.register(save)
@@ -0,0 +1,60 @@
+"""
+Model signal receivers that run after commit, once per batch of signals.
+
+A receiver connected with ``commit_receiver`` isn't called when the signal is
+sent; each call is collected (with ``on_commit_batch``) on the connection the
+signal names in its ``using`` argument, and the receiver is called after the
+transaction commits, once per sender, with all the calls' arguments::
+
+    @commit_receiver(post_save, sender=Thing)
+    def things_saved(sender, batch):
+        search_index.update_many([kwargs['instance'] for kwargs in batch])
+
+Calls made under a savepoint that is rolled back are dropped, like any other
+hook. Signals sent outside a transaction call the receiver immediately, with a
+one-item batch.
+
+"""
+import functools
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class CommitReceiver(object):
+    """The signal receiver that collects calls for ``func``."""
+    def __init__(self, func):
+        self.func = func
+        # the batch handler for each sender, which must stay the same object
+        # for on_commit_batch to collect all of a transaction's calls together
+        self.handlers = {}
+
+    def __call__(self, sender, **kwargs):
+        handler = self.handlers.get(sender)
+        if handler is None:
+            handler = self.handlers[sender] = functools.partial(
+                self.func, sender)
+        connection = connections[kwargs.get('using') or DEFAULT_DB_ALIAS]
+        if hasattr(connection, 'on_commit_batch'):
+            connection.on_commit_batch(handler, kwargs)
+        else:
+            handler([kwargs])
+
+
+def commit_receiver(signal, **connect_kwargs):
+    """
+    Connect the decorated function to ``signal`` (or each of a list of
+    signals), to be called after commit as ``func(sender, batch)``, where
+    ``batch`` is a list of the keyword arguments (including ``signal``) of
+    each time a signal was sent by ``sender`` in the transaction.
+
+    ``connect_kwargs`` (``sender``, ``dispatch_uid``) are passed to
+    ``Signal.connect``.
+
+    """
+    def decorator(func):
+        receiver = CommitReceiver(func)
+        signals = signal if isinstance(signal, (list, tuple)) else [signal]
+        for s in signals:
+            s.connect(receiver, weak=False, **connect_kwargs)
+        return func
+    return decorator
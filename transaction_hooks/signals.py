@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by ``transaction_hooks.metrics.send_signal`` (when configured as the
+# TRANSACTION_HOOKS_STATS_SINK) with the CommitHookStats of each transaction.
+commit_hook_stats = Signal(providing_args=['stats'])
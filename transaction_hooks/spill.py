@@ -0,0 +1,164 @@
+"""
+A pending-hook queue that spills to a temporary file when it gets large.
+
+``SpillableQueue`` supports the subset of the ``deque`` API that the
+connection uses for ``run_on_commit``. Whenever ``threshold`` hooks have been
+appended in memory, they are pickled and written to a temporary file as one
+chunk; chunks are read back one at a time as the queue is drained (or
+truncated by a savepoint rollback), so at most a few chunks' worth of hooks
+are in memory at once.
+
+Only hooks that read back as the same hook are written out: module-level
+functions (which are pickled by reference), and ``CommitHook`` records that
+set ``spillable = True`` wrapping one. Anything else stays in memory, in its
+place in the order: lambdas and other closures, keyed or batched hooks, and
+bound methods and ``functools.partial`` objects, which would be pickled by
+value and so run against a copy of the objects they refer to.
+
+"""
+from collections import deque
+import tempfile
+import types
+
+from django.utils import six
+from django.utils.six.moves import cPickle as pickle
+
+from transaction_hooks.hooks import CommitHook
+
+
+def spillable(func):
+    """May ``func`` be pickled to disk and read back in its place?"""
+    if isinstance(func, CommitHook):
+        if not func.spillable:
+            return False
+        func = func.func
+    return type(func) is types.FunctionType
+
+
+class SpillableQueue(object):
+    def __init__(self, threshold, dir=None):
+        self.threshold = threshold
+        self.dir = dir
+        # the queue is head + the chunks on disk + tail; head holds a chunk
+        # read back for draining from the left, tail the newest hooks
+        self.head = deque()
+        self.tail = deque()
+        # (offset, length, count) of each chunk in the file, oldest first
+        self.chunks = deque()
+        self.spilled = 0
+        # hooks that couldn't be written out, by serial number
+        self.kept = {}
+        self.serial = 0
+        self.file = None
+
+    def __len__(self):
+        return len(self.head) + self.spilled + len(self.tail)
+
+    def __iter__(self):
+        for func in self.head:
+            yield func
+        for chunk in list(self.chunks):
+            for func in self._read(chunk, forget=False):
+                yield func
+        for func in self.tail:
+            yield func
+
+    def append(self, func):
+        self.tail.append(func)
+        if len(self.tail) >= self.threshold:
+            self._spill()
+
+    def extend(self, funcs):
+        for func in funcs:
+            self.append(func)
+
+    def pop(self):
+        if not self.tail:
+            if self.chunks:
+                chunk = self.chunks.pop()
+                self.tail.extend(self._read(chunk))
+                # the chunk was the last thing in the file
+                self.file.seek(chunk[0])
+                self.file.truncate()
+            elif self.head:
+                return self.head.pop()
+        return self.tail.pop()
+
+    def popleft(self):
+        if not self.head:
+            if self.chunks:
+                self.head.extend(self._read(self.chunks.popleft()))
+                if not self.chunks:
+                    # nothing left on disk; the queue lives as long as the
+                    # connection, so don't let the file grow across
+                    # transactions
+                    self.file.seek(0)
+                    self.file.truncate()
+            else:
+                return self.tail.popleft()
+        return self.head.popleft()
+
+    def clear(self):
+        self.head.clear()
+        self.tail.clear()
+        self.chunks.clear()
+        self.spilled = 0
+        self.kept.clear()
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+
+    def close(self):
+        self.clear()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _spill(self):
+        entries = []
+        for func in self.tail:
+            data = None
+            if spillable(func):
+                try:
+                    data = pickle.dumps(func, pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    pass
+            if data is None:
+                self.serial += 1
+                self.kept[self.serial] = func
+                entries.append(self.serial)
+            else:
+                entries.append(data)
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(dir=self.dir)
+        data = pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)
+        if self.chunks:
+            self.file.seek(0, 2)
+        else:
+            # start afresh rather than after chunks already read back
+            self.file.seek(0)
+            self.file.truncate()
+        self.chunks.append((self.file.tell(), len(data), len(entries)))
+        self.file.write(data)
+        self.spilled += len(entries)
+        self.tail.clear()
+
+    def _read(self, chunk, forget=True):
+        """
+        Return the hooks in ``chunk``; if ``forget``, it is no longer part of
+        the queue.
+
+        """
+        offset, length, count = chunk
+        self.file.seek(offset)
+        entries = pickle.loads(self.file.read(length))
+        if forget:
+            self.spilled -= count
+            get_kept = self.kept.pop
+        else:
+            get_kept = self.kept.__getitem__
+        return [
+            get_kept(entry) if isinstance(entry, six.integer_types)
+            else pickle.loads(entry)
+            for entry in entries
+        ]
@@ -0,0 +1,7 @@
+import sys
+
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # uses async/await syntax
+    collect_ignore.append('test_aio.py')
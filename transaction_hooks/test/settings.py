@@ -1,3 +1,7 @@
 SECRET_KEY = 'required'
 
-INSTALLED_APPS = ['transaction_hooks.test']
+INSTALLED_APPS = [
+    'transaction_hooks',
+    'transaction_hooks.test',
+    'transaction_hooks.outbox',
+]
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import aio
+from .test_basic import ForcedError
+
+
+@pytest.fixture
+def loop():
+    """Run an event loop in another thread and schedule hooks on it."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    aio.set_event_loop(loop)
+    yield loop
+    aio.set_event_loop(None)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestCoroutineHooks(object):
+    def test_scheduled_on_loop_after_commit(self, loop):
+        ran = []
+
+        async def hook():
+            ran.append(asyncio.get_event_loop())
+            return 1
+
+        with atomic():
+            connection.on_commit(hook)
+            hooks = connection.async_commit_hooks()
+            assert ran == []
+
+        assert hooks.done.result(5) == [1]
+        assert ran == [loop]
+
+    def test_on_commit_async(self, loop):
+        def hook():
+            return asyncio.sleep(0, result=3)
+
+        with atomic():
+            connection.on_commit_async(hook)
+            hooks = connection.async_commit_hooks()
+
+        assert hooks.done.result(5) == [3]
+
+    def test_accepts_awaitables(self, loop):
+        with atomic():
+            connection.on_commit(asyncio.sleep(0, result=2))
+            hooks = connection.async_commit_hooks()
+
+        assert hooks.done.result(5) == [2]
+
+    def test_await_transaction_hooks(self, loop):
+        async def hook(n):
+            await asyncio.sleep(0)
+            return n
+
+        with atomic():
+            connection.on_commit(lambda: None)
+            connection.on_commit(hook(1))
+            connection.on_commit(hook(2))
+            hooks = connection.async_commit_hooks()
+
+        async def wait():
+            return await hooks.wait()
+
+        future = asyncio.run_coroutine_threadsafe(wait(), loop)
+        assert future.result(5) == [1, 2]
+
+    def test_discarded_with_savepoint(self, loop):
+        with atomic():
+            connection.on_commit(asyncio.sleep(0, result=1))
+            try:
+                with atomic():
+                    connection.on_commit(asyncio.sleep(0, result=2))
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            hooks = connection.async_commit_hooks()
+
+        assert hooks.done.result(5) == [1]
+
+    def test_rolled_back_transaction_resolves_empty(self, loop):
+        try:
+            with atomic():
+                connection.on_commit(asyncio.sleep(0, result=1))
+                hooks = connection.async_commit_hooks()
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        assert hooks.done.result(5) == []
+
+    def test_error_in_hook(self, loop):
+        async def hook():
+            raise ForcedError()
+
+        with atomic():
+            connection.on_commit(hook)
+            hooks = connection.async_commit_hooks()
+
+        with pytest.raises(ForcedError):
+            hooks.done.result(5)
+
+    def test_requires_loop(self):
+        async def hook():
+            pass
+
+        with pytest.raises(ImproperlyConfigured):
+            with atomic():
+                connection.on_commit(hook)
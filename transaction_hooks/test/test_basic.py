@@ -1,5 +1,5 @@
 from django.db import connection
-from django.db.transaction import atomic
+from django.db.transaction import atomic, TransactionManagementError
 import pytest
 
 from .models import Thing
@@ -51,6 +51,20 @@ class TestConnectionOnCommit(object):
         track.do(1)
         track.assert_done([1])
 
+    def test_per_hook_settings_tracked(self, track):
+        assert connection.commit_hook_plain
+        stats = []
+        connection.commit_hook_stats_sink = stats.append
+        try:
+            assert not connection.commit_hook_plain
+            with atomic():
+                track.do(1)
+        finally:
+            connection.commit_hook_stats_sink = None
+        assert connection.commit_hook_plain
+        track.assert_done([1])
+        assert stats[0].registered == 1
+
     def test_delays_execution_until_after_transaction_commit(self, track):
         with atomic():
             track.do(1)
@@ -119,6 +133,23 @@ class TestConnectionOnCommit(object):
 
         track.assert_done([2])
 
+    def test_released_savepoint_rolled_back_with_outer(self, track):
+        with atomic():
+            track.do(1)
+            try:
+                with atomic():
+                    with atomic():
+                        track.do(2)
+                    track.do(3)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            with atomic():
+                track.do(4)
+            track.do(5)
+
+        track.assert_done([1, 4, 5])
+
     def test_no_savepoints_atomic_merged_with_outer(self, track):
         with atomic():
             with atomic():
@@ -201,6 +232,15 @@ class TestConnectionOnCommit(object):
 
         track.assert_done([1])
 
+    def test_hook_registering_hook_runs_in_order(self, track):
+        with atomic():
+            track.do(1)
+            connection.on_commit(
+                lambda: connection.on_commit(lambda: track.notify(2)))
+            track.do(3)
+
+        track.assert_notified([1, 2, 3])
+
     def test_db_query_in_hook(self, track):
         with atomic():
             Thing.objects.create(num=1)
@@ -230,3 +270,307 @@ class TestConnectionOnCommit(object):
             connection.on_commit(on_commit)
 
         track.assert_done([1])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestKeyedOnCommit(object):
+    """Tests for deduplicating hooks with connection.on_commit(key=...)."""
+    def test_first_registration_wins_by_default(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), key='a')
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit(lambda: track.notify(3), key='a')
+
+        track.assert_notified([1, 2])
+
+    def test_last_registration_wins(self, track, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_key_wins', 'last')
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), key='a')
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit(lambda: track.notify(3), key='a')
+
+        track.assert_notified([2, 3])
+
+    def test_key_freed_by_savepoint_rollback(self, track):
+        with atomic():
+            try:
+                with atomic():
+                    connection.on_commit(lambda: track.notify(1), key='a')
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit(lambda: track.notify(2), key='a')
+
+        track.assert_notified([2])
+
+    def test_earlier_registration_restored_by_rollback(
+            self, track, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_key_wins', 'last')
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), key='a')
+            try:
+                with atomic():
+                    connection.on_commit(lambda: track.notify(2), key='a')
+                    raise ForcedError()
+            except ForcedError:
+                pass
+
+        track.assert_notified([1])
+
+    def test_keys_are_per_transaction(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), key='a')
+        with atomic():
+            connection.on_commit(lambda: track.notify(2), key='a')
+
+        track.assert_notified([1, 2])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnCommitBatch(object):
+    """Tests for connection.on_commit_batch()."""
+    def test_handler_called_once_with_all_items(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(0))
+            connection.on_commit_batch(track.notify, 1)
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit_batch(track.notify, 3)
+
+        track.assert_notified([0, [1, 3], 2])
+
+    def test_called_immediately_if_no_transaction(self, track):
+        connection.on_commit_batch(track.notify, 1)
+
+        track.assert_notified([[1]])
+
+    def test_excludes_items_from_rolled_back_savepoint(self, track):
+        with atomic():
+            connection.on_commit_batch(track.notify, 1)
+            try:
+                with atomic():
+                    connection.on_commit_batch(track.notify, 2)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit_batch(track.notify, 3)
+
+        track.assert_notified([[1, 3]])
+
+    def test_not_called_if_all_items_rolled_back(self, track):
+        with atomic():
+            try:
+                with atomic():
+                    connection.on_commit_batch(track.notify, 1)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit_batch(track.notify, 3)
+
+        track.assert_notified([2, [3]])
+
+    def test_batches_are_per_transaction(self, track):
+        with atomic():
+            connection.on_commit_batch(track.notify, 1)
+        with atomic():
+            connection.on_commit_batch(track.notify, 2)
+
+        track.assert_notified([[1], [2]])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnCommitPriority(object):
+    """Tests for connection.on_commit(priority=...)."""
+    def test_higher_priority_runs_first(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            connection.on_commit(lambda: track.notify(2), priority=-1)
+            connection.on_commit(lambda: track.notify(3), priority=10)
+            connection.on_commit(lambda: track.notify(4))
+            connection.on_commit(lambda: track.notify(5), priority=10)
+
+        track.assert_notified([3, 5, 1, 4, 2])
+
+    def test_discarded_with_savepoint(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            try:
+                with atomic():
+                    connection.on_commit(lambda: track.notify(2), priority=1)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit(lambda: track.notify(3), priority=1)
+
+        track.assert_notified([3, 1])
+
+    def test_keyed_hook_with_priority(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            try:
+                with atomic():
+                    connection.on_commit(
+                        lambda: track.notify(2), key='a', priority=1)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit(lambda: track.notify(3), key='a', priority=1)
+
+        track.assert_notified([3, 1])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnCommitCall(object):
+    """Tests for connection.on_commit_call()."""
+    def test_calls_with_args_after_commit(self, track):
+        with atomic():
+            connection.on_commit_call(track.notify, 1)
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit_call(track.notify, 3)
+            track.assert_notified([])
+
+        track.assert_notified([1, 2, 3])
+
+    def test_calls_immediately_if_no_transaction(self, track):
+        connection.on_commit_call(track.notify, 1)
+
+        track.assert_notified([1])
+
+    def test_discarded_with_savepoint(self, track):
+        with atomic():
+            try:
+                with atomic():
+                    connection.on_commit_call(track.notify, 1)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit_call(track.notify, 2)
+
+        track.assert_notified([2])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnBeforeCommit(object):
+    """Tests for connection.on_before_commit()."""
+    def test_runs_inside_transaction_before_commit(self, track):
+        nums = []
+
+        def flush():
+            track.assert_notified([])
+            Thing.objects.bulk_create([Thing(num=num) for num in nums])
+            connection.on_commit(lambda: track.notify(len(nums)))
+
+        with atomic():
+            connection.on_before_commit(flush)
+            nums.extend([1, 2, 3])
+            assert not Thing.objects.exists()
+
+        track.assert_notified([3])
+        assert sorted(t.num for t in Thing.objects.all()) == [1, 2, 3]
+
+    def test_runs_immediately_if_no_transaction(self, track):
+        connection.on_before_commit(lambda: track.notify(1))
+
+        track.assert_notified([1])
+
+    def test_runs_in_order_including_nested_registrations(self, track):
+        with atomic():
+            connection.on_before_commit(lambda: track.notify(1))
+            connection.on_before_commit(
+                lambda: connection.on_before_commit(lambda: track.notify(3)))
+            connection.on_before_commit(lambda: track.notify(2))
+
+        track.assert_notified([1, 2, 3])
+
+    def test_discarded_with_savepoint(self, track):
+        with atomic():
+            connection.on_before_commit(lambda: track.notify(1))
+            try:
+                with atomic():
+                    connection.on_before_commit(lambda: track.notify(2))
+                    connection.on_commit(lambda: track.notify(3))
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            with atomic():
+                connection.on_before_commit(lambda: track.notify(4))
+            connection.on_commit(lambda: track.notify(5))
+
+        track.assert_notified([1, 4, 5])
+
+    def test_not_run_if_transaction_rolled_back(self, track):
+        try:
+            with atomic():
+                connection.on_before_commit(lambda: track.notify(1))
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        with atomic():
+            pass
+
+        track.assert_notified([])
+
+    def test_error_rolls_back_transaction(self, track):
+        with pytest.raises(ForcedError):
+            with atomic():
+                track.do(1)
+                connection.on_before_commit(lambda: track.notify('error'))
+
+        track.assert_done([])
+        assert not connection.run_before_commit
+
+    def test_commit_forbidden_in_atomic_block(self, track):
+        with atomic():
+            connection.on_before_commit(lambda: track.notify(1))
+            connection.on_commit(lambda: track.notify(2))
+            with pytest.raises(TransactionManagementError):
+                connection.commit()
+            assert connection.in_atomic_block
+            track.assert_notified([])
+
+        track.assert_notified([1, 2])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnCommitMany(object):
+    """Tests for connection.on_commit_many() and on_commit_call_many()."""
+    def test_runs_in_order_after_commit(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(0))
+            connection.on_commit_many(
+                (lambda i=i: track.notify(i)) for i in range(1, 4))
+            connection.on_commit_call_many(track.notify, [(4,), (5,)])
+            track.assert_notified([])
+
+        track.assert_notified([0, 1, 2, 3, 4, 5])
+
+    def test_runs_immediately_if_no_transaction(self, track):
+        connection.on_commit_call_many(track.notify, [(1,), (2,)])
+
+        track.assert_notified([1, 2])
+
+    def test_discarded_with_savepoint_as_a_unit(self, track):
+        with atomic():
+            connection.on_commit_call(track.notify, 1)
+            try:
+                with atomic():
+                    connection.on_commit_call_many(
+                        track.notify, [(i,) for i in range(2, 100)])
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit_call(track.notify, 100)
+
+        track.assert_notified([1, 100])
+
+    def test_default_executor_applies(self, track, monkeypatch):
+        wrapped = []
+        monkeypatch.setattr(connection, 'commit_hook_default_executor', 'x')
+        monkeypatch.setattr(
+            connection, 'on_commit', lambda func: wrapped.append(func))
+        connection.on_commit_call_many(track.notify, [(1,), (2,)])
+
+        assert [hook.args for hook in wrapped] == [(1,), (2,)]
+        track.assert_notified([])
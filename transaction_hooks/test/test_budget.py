@@ -0,0 +1,190 @@
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import budget, errors, executors
+from transaction_hooks.metrics import hook_name
+from .test_basic import ForcedError
+from .test_executors import ThreadTracker
+
+
+pytest.importorskip('concurrent.futures')
+
+
+@pytest.fixture
+def track():
+    return ThreadTracker()
+
+
+@pytest.fixture
+def latency_budget(settings, monkeypatch):
+    """Configure a latency budget for the default connection; learn afresh."""
+    settings.TRANSACTION_HOOKS_EXECUTORS = {
+        'test': {'BACKEND': 'thread', 'MAX_WORKERS': 2},
+    }
+    monkeypatch.setattr(budget, 'durations', {})
+
+    def configure(**config):
+        config.setdefault('EXECUTOR', 'test')
+        monkeypatch.setattr(
+            connection, 'commit_hook_budget', budget.get_config(config))
+
+    yield configure
+    executors.shutdown_executors()
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestLatencyBudget(object):
+    def test_hooks_past_budget_run_in_executor_in_order(self, track,
+                                                        latency_budget):
+        latency_budget(BUDGET=0)
+        with atomic():
+            for i in range(5):
+                connection.on_commit(lambda i=i: track.notify(i))
+        executors.shutdown_executors()
+
+        track.assert_notified(list(range(5)))
+        assert threading.current_thread() not in track.threads
+
+    def test_runs_on_committing_thread_until_budget_used(self, track,
+                                                         latency_budget):
+        latency_budget(BUDGET=0.01, SLOW_HOOK=60)
+
+        def slow():
+            time.sleep(0.02)
+            track.notify('slow')
+
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            connection.on_commit(slow)
+            connection.on_commit(lambda: track.notify(2))
+            connection.on_commit(lambda: track.notify(3))
+        assert track.notified[:2] == [1, 'slow']
+        executors.shutdown_executors()
+
+        track.assert_notified([1, 'slow', 2, 3])
+        assert len(track.threads) == 2
+
+    def test_slow_hooks_sent_to_executor_up_front(self, latency_budget):
+        latency_budget(BUDGET=60, SLOW_HOOK=0.01)
+        main = threading.current_thread()
+        ran_on = {}
+
+        def slow():
+            ran_on['slow'] = threading.current_thread()
+            time.sleep(0.02)
+
+        def fast():
+            ran_on['fast'] = threading.current_thread()
+
+        def commit():
+            with atomic():
+                connection.on_commit(slow)
+                connection.on_commit(fast)
+            executors.shutdown_executors()
+
+        commit()
+        # nothing learned yet
+        assert ran_on == {'slow': main, 'fast': main}
+
+        commit()
+        assert ran_on['slow'] is not main
+        assert ran_on['fast'] is main
+        assert budget.durations[hook_name(slow)] >= 0.02
+        assert budget.durations[hook_name(fast)] < 0.01
+
+    def test_closes_old_connections_in_worker(self, track, latency_budget,
+                                              monkeypatch):
+        closed_on = []
+        monkeypatch.setattr(
+            budget, 'close_old_connections',
+            lambda: closed_on.append(threading.current_thread()))
+        latency_budget(BUDGET=0)
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+        assert closed_on == list(track.threads)
+
+    def test_dispatching_hooks_run_at_commit(self, track, latency_budget,
+                                             settings):
+        settings.TRANSACTION_HOOKS_EXECUTORS['other'] = {'BACKEND': 'thread'}
+        latency_budget(BUDGET=0)
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), executor='other')
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+        assert threading.current_thread() not in track.threads
+        assert budget.durations == {}
+
+    def test_counted_in_stats(self, track, latency_budget, monkeypatch):
+        stats = []
+        monkeypatch.setattr(connection, 'commit_hook_stats_sink', stats.append)
+        latency_budget(BUDGET=0)
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            connection.on_commit(lambda: track.notify(2))
+        executors.shutdown_executors()
+
+        track.assert_notified([1, 2])
+        assert stats[0].executed == 0
+        assert stats[0].handed_off == 2
+
+    def test_errors_isolated_in_executor(self, track, latency_budget,
+                                         monkeypatch):
+        handled = []
+        monkeypatch.setattr(connection, 'commit_hook_isolate_errors', True)
+        monkeypatch.setattr(
+            connection, 'commit_hook_error_handler', handled.extend)
+        latency_budget(BUDGET=0)
+        with atomic():
+            connection.on_commit(lambda: track.notify('error'))
+            connection.on_commit(lambda: track.notify(1))
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+        [(hook, exc_info)] = handled
+        assert isinstance(exc_info[1], ForcedError)
+
+    def test_isolated_errors_raised_in_executor(self, track,
+                                                latency_budget, monkeypatch):
+        logged = []
+        monkeypatch.setattr(connection, 'commit_hook_isolate_errors', True)
+        monkeypatch.setattr(
+            executors.logger, 'error', lambda *a, **kw: logged.append(a))
+        latency_budget(BUDGET=0)
+        with atomic():
+            connection.on_commit(lambda: track.notify('error'))
+            connection.on_commit(lambda: track.notify(1))
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+        [(message, exc)] = logged
+        assert isinstance(exc, errors.CommitHookErrors)
+
+
+def test_unknown_executor_rejected(settings):
+    settings.TRANSACTION_HOOKS_EXECUTORS = {}
+    settings.TRANSACTION_HOOKS_LATENCY_BUDGET = {'BUDGET': 0.01}
+    with pytest.raises(ImproperlyConfigured):
+        wrapper = connections[DEFAULT_DB_ALIAS]
+        wrapper.__class__(wrapper.settings_dict, 'budget')
+
+
+def test_config_defaults():
+    assert budget.get_config(None) is None
+    assert budget.get_config({'BUDGET': 0.1}) == {
+        'BUDGET': 0.1, 'EXECUTOR': 'default', 'SLOW_HOOK': 0.1}
+
+
+def test_learned_duration_is_moving_average(monkeypatch):
+    monkeypatch.setattr(budget, 'durations', {})
+    budget.learn('hook', 1.0)
+    budget.learn('hook', 2.0)
+    assert budget.durations['hook'] == pytest.approx(1.2)
@@ -0,0 +1,93 @@
+from django.db import connection, connections
+from django.db.transaction import atomic
+import pytest
+
+import transaction_hooks
+from .test_basic import ForcedError, track  # noqa
+
+
+@pytest.fixture
+def other(transactional_db):
+    """A second alias: another connection to the default test database."""
+    connections.databases['other'] = dict(connections.databases['default'])
+    yield 'other'
+    connections['other'].close()
+    del connections['other']
+    del connections.databases['other']
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestJointOnCommit(object):
+    def test_runs_once_after_all_commit(self, track, other):
+        with atomic():
+            with atomic(using=other):
+                transaction_hooks.on_commit(
+                    lambda: track.notify(1), using=['default', other])
+            track.assert_notified([])
+
+        track.assert_notified([1])
+
+    def test_runs_after_last_commit_in_either_order(self, track, other):
+        with atomic(using=other):
+            with atomic():
+                transaction_hooks.on_commit(
+                    lambda: track.notify(1), using=['default', other])
+            track.assert_notified([])
+
+        track.assert_notified([1])
+
+    def test_dropped_if_any_rolls_back(self, track, other):
+        with atomic():
+            try:
+                with atomic(using=other):
+                    transaction_hooks.on_commit(
+                        lambda: track.notify(1), using=['default', other])
+                    raise ForcedError()
+            except ForcedError:
+                pass
+
+        track.assert_notified([])
+        assert not connection.run_on_commit
+
+    def test_dropped_if_last_rolls_back_after_first_commits(self, track,
+                                                            other):
+        try:
+            with atomic(using=other):
+                with atomic():
+                    transaction_hooks.on_commit(
+                        lambda: track.notify(1), using=['default', other])
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        track.assert_notified([])
+
+    def test_dropped_with_savepoint(self, track, other):
+        with atomic():
+            with atomic(using=other):
+                try:
+                    with atomic():
+                        transaction_hooks.on_commit(
+                            lambda: track.notify(1), using=['default', other])
+                        raise ForcedError()
+                except ForcedError:
+                    pass
+
+        track.assert_notified([])
+
+    def test_alias_without_transaction_counts_as_committed(self, track,
+                                                           other):
+        with atomic():
+            transaction_hooks.on_commit(
+                lambda: track.notify(1), using=['default', other])
+            track.assert_notified([])
+
+        track.assert_notified([1])
+
+    def test_single_alias(self, track):
+        with atomic():
+            transaction_hooks.on_commit(lambda: track.notify(1))
+            transaction_hooks.on_commit(
+                lambda: track.notify(2), using=['default', 'default'])
+
+        track.assert_notified([1, 2])
@@ -0,0 +1,90 @@
+import threading
+
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import debounce
+from .test_basic import ForcedError, track  # noqa
+
+
+@pytest.fixture
+def debouncer(monkeypatch):
+    """Hand debounced hooks to a fresh Debouncer."""
+    debouncer = debounce.Debouncer()
+    monkeypatch.setattr(debounce, 'debouncer', debouncer)
+    yield debouncer
+    debouncer.flush()
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestDebouncedHooks(object):
+    def test_runs_once_per_window_across_transactions(self, track,
+                                                      debouncer):
+        ran = threading.Event()
+
+        def purge(n):
+            track.notify(n)
+            ran.set()
+
+        for n in range(20):
+            with atomic():
+                connection.on_commit(
+                    lambda n=n: purge(n), debounce_key='row:1', window=0.2)
+        track.assert_notified([])
+
+        assert ran.wait(5)
+        # the latest registration runs
+        track.assert_notified([19])
+
+    def test_keys_debounced_separately(self, track, debouncer):
+        with atomic():
+            for key in ['a', 'b', 'a']:
+                connection.on_commit(
+                    lambda key=key: track.notify(key), debounce_key=key,
+                    window=60)
+
+        debouncer.flush()
+
+        track.assert_notified(['a', 'b'])
+
+    def test_discarded_with_savepoint(self, track, debouncer):
+        with atomic():
+            try:
+                with atomic():
+                    connection.on_commit(
+                        lambda: track.notify(1), debounce_key='k', window=60)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+        assert debouncer.pending == {}
+
+        with atomic():
+            connection.on_commit(
+                lambda: track.notify(2), debounce_key='k', window=60)
+        debouncer.flush()
+
+        track.assert_notified([2])
+
+    def test_handed_off_immediately_if_no_transaction(self, track,
+                                                      debouncer):
+        connection.on_commit(lambda: track.notify(1), debounce_key='k',
+                             window=60)
+        track.assert_notified([])
+        assert list(debouncer.pending) == ['k']
+
+        debouncer.flush()
+
+        track.assert_notified([1])
+
+    def test_runs_again_in_next_window(self, track, debouncer):
+        for n in range(2):
+            with atomic():
+                connection.on_commit(
+                    lambda n=n: track.notify(n), debounce_key='k', window=0)
+            for _ in range(500):
+                if len(track.notified) > n:
+                    break
+                threading.Event().wait(0.01)
+
+        track.assert_notified([0, 1])
@@ -0,0 +1,128 @@
+import threading
+
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import errors
+from .test_basic import ForcedError, track  # noqa
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    """Keep running the default connection's hooks after a failure."""
+    monkeypatch.setattr(connection, 'commit_hook_isolate_errors', True)
+
+
+@pytest.fixture
+def retry_queue(monkeypatch, isolated):
+    """Retry failed hooks on a fresh, fast RetryQueue."""
+    given_up = []
+    queue = errors.RetryQueue(
+        max_attempts=2, backoff=0.01,
+        error_handler=lambda failures: given_up.extend(failures))
+    queue.given_up = given_up
+    monkeypatch.setattr(errors, '_retry_queue', queue)
+    monkeypatch.setattr(connection, 'commit_hook_retry', True)
+    return queue
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+@pytest.mark.usefixtures('transactional_db', 'isolated')
+class TestIsolatedErrors(object):
+    def test_runs_remaining_hooks_then_raises(self, track):
+        with pytest.raises(errors.CommitHookErrors) as excinfo:
+            with atomic():
+                connection.on_commit(lambda: track.notify(1))
+                connection.on_commit(lambda: track.notify('error'))
+                connection.on_commit(lambda: track.notify(2))
+                connection.on_commit(lambda: track.notify('error'))
+                connection.on_commit(lambda: track.notify(3))
+
+        track.assert_notified([1, 2, 3])
+        assert len(excinfo.value.errors) == 2
+        assert all(isinstance(exc_info[1], ForcedError)
+                   for _, exc_info in excinfo.value.errors)
+        assert not connection.run_on_commit
+
+    def test_error_handler(self, track, monkeypatch):
+        handled = []
+        monkeypatch.setattr(
+            connection, 'commit_hook_error_handler', handled.append)
+        with atomic():
+            connection.on_commit(lambda: track.notify('error'))
+            connection.on_commit(lambda: track.notify(1))
+
+        track.assert_notified([1])
+        [[(hook, exc_info)]] = handled
+        assert isinstance(exc_info[1], ForcedError)
+
+    def test_with_stats(self, track, monkeypatch):
+        stats = []
+        monkeypatch.setattr(connection, 'commit_hook_stats_sink', stats.append)
+        with pytest.raises(errors.CommitHookErrors):
+            with atomic():
+                connection.on_commit(lambda: track.notify('error'))
+                connection.on_commit(lambda: track.notify(1))
+
+        track.assert_notified([1])
+        assert stats[0].executed == 2
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestRetry(object):
+    def test_retried_until_success(self, retry_queue):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 2:
+                raise ForcedError()
+
+        with atomic():
+            connection.on_commit(flaky)
+
+        assert wait_for(lambda: len(calls) == 2)
+        assert retry_queue.given_up == []
+
+    def test_given_up_after_max_attempts(self, track, retry_queue):
+        with atomic():
+            connection.on_commit(lambda: track.notify('error'))
+            connection.on_commit(lambda: track.notify(1))
+
+        track.assert_notified([1])
+        assert wait_for(lambda: retry_queue.given_up)
+        [(hook, exc_info)] = retry_queue.given_up
+        assert isinstance(exc_info[1], ForcedError)
+        assert len(retry_queue) == 0
+
+    def test_batch_retried_with_its_items(self, retry_queue):
+        batches = []
+
+        def handler(items):
+            batches.append(items)
+            if len(batches) < 2:
+                raise ForcedError()
+
+        with atomic():
+            connection.on_commit_batch(handler, 1)
+            connection.on_commit_batch(handler, 2)
+
+        assert wait_for(lambda: len(batches) == 2)
+        assert batches == [[1, 2], [1, 2]]
+
+
+def test_backoff_doubles_up_to_max():
+    queue = errors.RetryQueue(backoff=1.0, max_backoff=3.0)
+    queue.thread = 'not started'
+    for attempt in (1, 2, 3):
+        queue.add(None, attempt)
+    due = sorted(entry[0] for entry in queue.scheduled)
+    assert [round(b - due[0], 1) for b in due] == [0, 1.0, 2.0]
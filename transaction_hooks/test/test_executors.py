@@ -0,0 +1,223 @@
+import functools
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import executors
+from .test_basic import ForcedError, Tracker
+
+
+pytest.importorskip('concurrent.futures')
+
+
+class ThreadTracker(Tracker):
+    """Also track which thread each notification came from."""
+    def __init__(self):
+        super(ThreadTracker, self).__init__()
+        self.threads = set()
+
+    def notify(self, id_):
+        self.threads.add(threading.current_thread())
+        super(ThreadTracker, self).notify(id_)
+
+
+@pytest.fixture
+def track():
+    return ThreadTracker()
+
+
+@pytest.fixture
+def executor(settings):
+    """Configure a thread-pool executor named 'test'."""
+    settings.TRANSACTION_HOOKS_EXECUTORS = {
+        'test': {'BACKEND': 'thread', 'MAX_WORKERS': 2},
+    }
+    yield 'test'
+    executors.shutdown_executors()
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestExecutorHooks(object):
+    def test_runs_off_thread_in_order(self, track, executor):
+        with atomic():
+            for i in range(5):
+                connection.on_commit(
+                    lambda i=i: track.notify(i), executor=executor)
+            track.assert_notified([])
+        executors.shutdown_executors()
+
+        track.assert_notified([0, 1, 2, 3, 4])
+        assert threading.current_thread() not in track.threads
+
+    def test_closes_old_connections_in_worker(self, track, executor,
+                                              monkeypatch):
+        closed_on = []
+        monkeypatch.setattr(
+            executors, 'close_old_connections',
+            lambda: closed_on.append(threading.current_thread()))
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), executor=executor)
+            connection.on_commit(lambda: track.notify(2), executor=executor)
+        executors.shutdown_executors()
+
+        track.assert_notified([1, 2])
+        assert closed_on == list(track.threads)
+
+    def test_default_executor_setting(self, track, executor, monkeypatch):
+        monkeypatch.setattr(
+            connection, 'commit_hook_default_executor', executor)
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            connection.on_commit(lambda: track.notify(2), executor=False)
+        executors.shutdown_executors()
+
+        assert sorted(track.notified) == [1, 2]
+        assert len(track.threads) == 2
+
+    def test_not_submitted_if_rolled_back(self, track, executor):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1), executor=executor)
+            try:
+                with atomic():
+                    connection.on_commit(
+                        lambda: track.notify(2), executor=executor)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+
+    def test_submitted_immediately_if_no_transaction(self, track, executor):
+        connection.on_commit(lambda: track.notify(1), executor=executor)
+        executors.shutdown_executors()
+
+        track.assert_notified([1])
+        assert threading.current_thread() not in track.threads
+
+    def test_unknown_executor(self, settings):
+        settings.TRANSACTION_HOOKS_EXECUTORS = {}
+        with pytest.raises(ImproperlyConfigured):
+            with atomic():
+                connection.on_commit(lambda: None, executor='missing')
+
+    def test_unpicklable_rejected_for_process_pool(self, process_executor,
+                                                   monkeypatch):
+        with atomic():
+            with pytest.raises(Exception):
+                connection.on_commit(lambda: None, executor=process_executor)
+            monkeypatch.setattr(
+                connection, 'commit_hook_default_executor', process_executor)
+            with pytest.raises(Exception):
+                connection.on_commit(lambda: None)
+        with pytest.raises(Exception):
+            connection.on_commit(lambda: None)
+
+    def test_unpicklable_submission_releases_slot(self, settings,
+                                                  monkeypatch):
+        settings.TRANSACTION_HOOKS_EXECUTORS = {
+            'processes': {'BACKEND': 'process', 'MAX_PENDING': 1},
+        }
+        errors = []
+        monkeypatch.setattr(
+            executors.logger, 'error', lambda *a, **kw: errors.append(a))
+        try:
+            for _ in range(2):
+                assert executors.submit_hooks(
+                    'processes', [lambda: None]) is None
+            future = executors.submit_hooks(
+                'processes', [functools.partial(pow, 2, 10)])
+            assert future.result(timeout=10) is None
+        finally:
+            executors.shutdown_executors()
+        assert len(errors) == 2
+
+
+@pytest.fixture
+def process_executor(settings):
+    """Configure a process-pool executor named 'processes'."""
+    settings.TRANSACTION_HOOKS_EXECUTORS = {
+        'processes': {'BACKEND': 'process', 'MAX_WORKERS': 2},
+    }
+    yield 'processes'
+    executors.shutdown_executors()
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOnCommitSubmit(object):
+    def test_result_after_commit(self, process_executor):
+        with atomic():
+            future = connection.on_commit_submit(
+                process_executor, pow, 2, 10)
+            assert not future.done()
+
+        assert future.result(timeout=30) == 1024
+
+    def test_error_returned(self, process_executor):
+        with atomic():
+            future = connection.on_commit_submit(
+                process_executor, divmod, 1, 0)
+
+        with pytest.raises(ZeroDivisionError):
+            future.result(timeout=30)
+
+    def test_unpicklable_rejected(self, process_executor):
+        with atomic():
+            with pytest.raises(Exception):
+                connection.on_commit_submit(process_executor, lambda: None)
+
+    def test_cancelled_if_rolled_back(self, track, executor):
+        with atomic():
+            kept = connection.on_commit_submit(executor, track.notify, 1)
+            try:
+                with atomic():
+                    dropped = connection.on_commit_submit(
+                        executor, track.notify, 2)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            assert dropped.cancelled()
+
+        assert kept.result(timeout=5) is None
+        track.assert_notified([1])
+
+    @pytest.mark.skipif(not hasattr(threading, 'Barrier'),
+                        reason="requires threading.Barrier")
+    def test_tasks_run_in_parallel(self, executor):
+        started = threading.Barrier(2)
+        with atomic():
+            results = [
+                connection.on_commit_submit(executor, started.wait, 5)
+                for _ in range(2)
+            ]
+
+        # each would time out if the other weren't running at the same time
+        assert sorted(f.result(timeout=10) for f in results) == [0, 1]
+
+    def test_submitted_immediately_if_no_transaction(self, executor):
+        future = connection.on_commit_submit(executor, pow, 3, 2)
+
+        assert future.result(timeout=5) == 9
+
+
+def test_bounded_executor_blocks_when_full():
+    from concurrent.futures import ThreadPoolExecutor
+    bounded = executors.BoundedExecutor(ThreadPoolExecutor(max_workers=1), 1)
+    release = threading.Event()
+    bounded.submit(release.wait)
+    submitted = threading.Event()
+
+    def submit_second():
+        bounded.submit(lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=submit_second)
+    thread.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    bounded.shutdown()
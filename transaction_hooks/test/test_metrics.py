@@ -0,0 +1,170 @@
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks import errors, metrics, signals
+from .test_basic import ForcedError
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    """Collect CommitHookStats from the default connection in a list."""
+    collected = []
+    monkeypatch.setattr(
+        connection, 'commit_hook_stats_sink', collected.append)
+    return collected
+
+
+def hook():
+    pass
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestCommitHookStats(object):
+    def test_commit(self, stats):
+        with atomic():
+            connection.on_commit(hook)
+            with atomic():
+                connection.on_commit(hook)
+            connection.on_commit_batch(lambda items: None, 1)
+
+        [s] = stats
+        assert (s.registered, s.executed, s.discarded) == (3, 3, 0)
+        assert s.peak_pending == 3
+        assert s.committed_at is not None
+        name = 'transaction_hooks.test.test_metrics.hook'
+        assert [t[0] for t in s.hook_timings[:2]] == [name, name]
+        assert all(delay >= 0 and duration >= 0
+                   for _, delay, duration in s.hook_timings)
+
+    def test_savepoint_rollback(self, stats):
+        with atomic():
+            connection.on_commit(hook)
+            try:
+                with atomic():
+                    connection.on_commit(hook)
+                    connection.on_commit(hook)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+
+        [s] = stats
+        assert s.registered == 3
+        assert s.executed == 1
+        assert s.discarded_savepoint_rollback == 2
+        assert s.peak_pending == 3
+
+    def test_rollback(self, stats):
+        try:
+            with atomic():
+                connection.on_commit(hook)
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        [s] = stats
+        assert (s.executed, s.discarded_rollback) == (0, 1)
+        assert s.committed_at is None
+
+    @pytest.mark.skipif(
+        not connection.features.test_db_allows_multiple_connections,
+        reason='DB backend does not allow reconnect'
+    )
+    def test_close(self, stats):
+        with atomic():
+            connection.on_commit(hook)
+            connection.close()
+        connection.connect()
+
+        [s] = stats
+        assert s.discarded_connection == 1
+
+    def test_error_in_hook(self, stats):
+        def error():
+            raise ForcedError()
+
+        with pytest.raises(ForcedError):
+            with atomic():
+                connection.on_commit(error)
+                connection.on_commit(hook)
+
+        [s] = stats
+        assert (s.executed, s.discarded_error) == (1, 1)
+
+    def test_no_stats_without_hooks(self, stats):
+        with atomic():
+            pass
+
+        assert stats == []
+
+    def test_not_collected_without_sink(self):
+        with atomic():
+            connection.on_commit(hook)
+            assert connection.commit_hook_stats is None
+
+    def test_signal_sink(self, monkeypatch):
+        monkeypatch.setattr(
+            connection, 'commit_hook_stats_sink', metrics.send_signal)
+        received = []
+
+        def receiver(sender, stats, **kwargs):
+            received.append(stats)
+
+        signals.commit_hook_stats.connect(receiver)
+        try:
+            with atomic():
+                connection.on_commit(hook)
+        finally:
+            signals.commit_hook_stats.disconnect(receiver)
+
+        [s] = received
+        assert s.executed == 1
+
+
+@pytest.fixture
+def storm_threshold(monkeypatch):
+    """Warn when a hook is registered more than 3 times in a transaction."""
+    monkeypatch.setattr(connection, 'commit_hook_storm_threshold', 3)
+    warned = []
+    monkeypatch.setattr(
+        'transaction_hooks.mixin.logger.warning',
+        lambda msg, *args: warned.append(msg % args))
+    return warned
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestHookStorms(object):
+    def test_warns_once_with_stack(self, storm_threshold):
+        with atomic():
+            for i in range(10):
+                connection.on_commit(lambda: None)
+            connection.on_commit(hook)
+
+        [warning] = storm_threshold
+        assert 'registered more than 3 times' in warning
+        assert 'test_warns_once_with_stack' in warning
+
+    def test_counts_by_function(self, storm_threshold):
+        with atomic():
+            for i in range(3):
+                connection.on_commit(hook)
+                connection.on_commit_call(hook)
+                connection.on_commit(lambda: None, key=i)
+
+        [warning] = storm_threshold
+        assert 'test_metrics.hook' in warning
+
+    def test_counts_per_transaction(self, storm_threshold):
+        for _ in range(3):
+            with atomic():
+                for _ in range(3):
+                    connection.on_commit(hook)
+
+        assert storm_threshold == []
+
+    def test_strict(self, storm_threshold, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_storm_strict', True)
+        with pytest.raises(errors.HookStormError):
+            with atomic():
+                for _ in range(4):
+                    connection.on_commit(hook)
@@ -0,0 +1,143 @@
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.db.transaction import atomic
+from django.http import HttpResponse
+from django.test import RequestFactory
+import pytest
+
+from transaction_hooks.middleware import (
+    DeferCommitHooksMiddleware, DeferCommitHooksWSGIMiddleware)
+from .test_basic import ForcedError, track  # noqa
+
+
+@pytest.fixture
+def deferring(request):
+    connection.defer_commit_hooks()
+    request.addfinalizer(
+        lambda: setattr(connection, 'commit_hooks_deferred', None))
+
+
+@pytest.mark.usefixtures('transactional_db', 'deferring')
+class TestDeferCommitHooks(object):
+    def test_run_when_asked(self, track):
+        with atomic():
+            track.do(1)
+        with atomic():
+            track.do(2)
+        track.assert_notified([])
+
+        connection.run_deferred_commit_hooks()
+
+        track.assert_done([1, 2])
+        assert connection.commit_hooks_deferred is None
+
+    def test_keeps_order_and_discards(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify(1))
+            connection.on_commit(lambda: track.notify(2), priority=1)
+            try:
+                with atomic():
+                    connection.on_commit(lambda: track.notify(3))
+                    raise ForcedError()
+            except ForcedError:
+                pass
+
+        connection.run_deferred_commit_hooks()
+
+        track.assert_notified([2, 1])
+
+    def test_error_stops_only_its_transaction(self, track):
+        with atomic():
+            connection.on_commit(lambda: track.notify('error'))
+            connection.on_commit(lambda: track.notify(1))
+        with atomic():
+            connection.on_commit(lambda: track.notify(2))
+
+        with pytest.raises(ForcedError):
+            connection.run_deferred_commit_hooks()
+
+        track.assert_notified([2])
+        assert not connection.run_on_commit
+
+    def test_hooks_outside_transaction_not_deferred(self, track):
+        track.do(1)
+
+        track.assert_done([1])
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestMiddleware(object):
+    def test_runs_hooks_when_response_closed(self, track):
+        middleware = DeferCommitHooksMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        with atomic():
+            track.do(1)
+        response = middleware.process_response(request, HttpResponse())
+        track.assert_notified([])
+
+        response.close()
+
+        track.assert_done([1])
+        assert connection.commit_hooks_deferred is None
+
+    def test_response_closed_inside_atomic_block(self, track, monkeypatch):
+        logged = []
+        monkeypatch.setattr(
+            'transaction_hooks.middleware.logger.exception',
+            lambda *a: logged.append(a))
+        # as the test client does, so that closing the response doesn't
+        # close the connection
+        request_finished.disconnect(close_old_connections)
+        middleware = DeferCommitHooksMiddleware()
+        request = RequestFactory().get('/')
+        try:
+            with atomic():
+                middleware.process_request(request)
+                with atomic():
+                    track.do(1)
+                response = middleware.process_response(
+                    request, HttpResponse())
+                response.close()
+                assert connection.commit_hooks_deferred is None
+        finally:
+            request_finished.connect(close_old_connections)
+        track.assert_done([1])
+
+        with atomic():
+            track.do(2)
+
+        track.assert_done([1, 2])
+        assert logged == []
+
+    def test_wsgi_runs_hooks_when_body_closed(self, track):
+        def app(environ, start_response):
+            with atomic():
+                track.do(1)
+            start_response('200 OK', [])
+            return [b'done']
+
+        result = DeferCommitHooksWSGIMiddleware(app)({}, lambda *a: None)
+        assert list(result) == [b'done']
+        track.assert_notified([])
+
+        result.close()
+
+        track.assert_done([1])
+
+    def test_wsgi_logs_errors(self, track, monkeypatch):
+        logged = []
+        monkeypatch.setattr(
+            'transaction_hooks.middleware.logger.exception',
+            lambda *a: logged.append(a))
+
+        def app(environ, start_response):
+            with atomic():
+                connection.on_commit(lambda: track.notify('error'))
+                connection.on_commit(lambda: track.notify(1))
+            return []
+
+        DeferCommitHooksWSGIMiddleware(app)({}, None).close()
+
+        track.assert_notified([])
+        assert len(logged) == 1
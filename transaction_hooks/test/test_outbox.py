@@ -0,0 +1,154 @@
+from datetime import timedelta
+from functools import partial
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+import pytest
+
+from transaction_hooks.outbox.models import OutboxHook
+from transaction_hooks.outbox.relay import (
+    relay_batch, requeue_hooks, serialize_hook)
+from .models import Thing
+from .test_basic import ForcedError
+
+
+def create_thing(num):
+    Thing.objects.create(num=num)
+
+
+def fail():
+    raise ForcedError()
+
+
+def things():
+    return sorted(t.num for t in Thing.objects.all())
+
+
+class TestSerializeHook(object):
+    def test_function(self):
+        assert serialize_hook(fail) == (
+            'transaction_hooks.test.test_outbox.fail',
+            '{"args": [], "kwargs": {}}')
+
+    def test_partial(self):
+        path, arguments = serialize_hook(partial(create_thing, num=1))
+        assert path == 'transaction_hooks.test.test_outbox.create_thing'
+        assert arguments == '{"args": [], "kwargs": {"num": 1}}'
+
+    def test_rejects_lambda(self):
+        with pytest.raises(ValueError):
+            serialize_hook(lambda: None)
+
+    def test_rejects_unserializable_arguments(self):
+        with pytest.raises(ValueError):
+            serialize_hook(partial(create_thing, object()))
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestOutbox(object):
+    def test_saved_in_transaction(self):
+        with atomic():
+            connection.on_commit(partial(create_thing, 1), outbox=True)
+            try:
+                with atomic():
+                    connection.on_commit(partial(create_thing, 2), outbox=True)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            assert OutboxHook.objects.count() == 1
+
+        assert OutboxHook.objects.count() == 1
+        assert things() == []
+
+    def test_discarded_with_transaction(self):
+        try:
+            with atomic():
+                connection.on_commit(partial(create_thing, 1), outbox=True)
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        assert OutboxHook.objects.count() == 0
+
+    def test_outbox_setting(self, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_outbox', True)
+        with atomic():
+            connection.on_commit(partial(create_thing, 1))
+            connection.on_commit_call(create_thing, 2)
+
+        assert relay_batch() == (2, 2)
+        assert things() == [1, 2]
+
+    def test_relay_in_order(self):
+        with atomic():
+            for num in range(5):
+                connection.on_commit(partial(create_thing, num), outbox=True)
+
+        assert relay_batch(batch_size=3) == (3, 3)
+        assert things() == [0, 1, 2]
+        assert relay_batch(batch_size=3) == (2, 2)
+        assert things() == [0, 1, 2, 3, 4]
+        assert OutboxHook.objects.count() == 0
+
+    def test_failed_hook_kept(self):
+        with atomic():
+            connection.on_commit(fail, outbox=True)
+            connection.on_commit(partial(create_thing, 1), outbox=True)
+
+        assert relay_batch(backoff=0) == (2, 1)
+        assert things() == [1]
+        [hook] = OutboxHook.objects.all()
+        assert hook.attempts == 1
+        assert 'ForcedError' in hook.last_error
+
+        assert relay_batch(max_attempts=1) == (0, 0)
+        assert OutboxHook.objects.get().attempts == 1
+
+    def test_failed_hook_retried_after_backoff(self):
+        with atomic():
+            connection.on_commit(fail, outbox=True)
+
+        assert relay_batch(backoff=60) == (1, 0)
+        hook = OutboxHook.objects.get()
+        assert hook.next_attempt > timezone.now() + timedelta(seconds=50)
+        assert relay_batch() == (0, 0)
+
+        OutboxHook.objects.update(next_attempt=timezone.now())
+        assert relay_batch(backoff=60, max_backoff=90) == (1, 0)
+        hook = OutboxHook.objects.get()
+        assert hook.attempts == 2
+        assert hook.next_attempt < timezone.now() + timedelta(seconds=91)
+        assert hook.next_attempt > timezone.now() + timedelta(seconds=80)
+
+    def test_requeue(self):
+        with atomic():
+            connection.on_commit(fail, outbox=True)
+        relay_batch(max_attempts=1)
+
+        assert requeue_hooks(max_attempts=1) == 1
+        hook = OutboxHook.objects.get()
+        assert (hook.attempts, hook.next_attempt) == (0, None)
+
+    def test_relay_command_stops_when_whole_batch_fails(self):
+        with atomic():
+            for _ in range(3):
+                connection.on_commit(fail, outbox=True)
+
+        call_command(
+            'relay_commit_hooks', batch_size=2, backoff=0, max_attempts=5)
+
+        # one batch, rather than using up every attempt
+        assert [hook.attempts for hook in OutboxHook.objects.all()] == [
+            1, 1, 0]
+
+    def test_relay_command(self):
+        with atomic():
+            for num in range(3):
+                connection.on_commit(partial(create_thing, num), outbox=True)
+
+        call_command('relay_commit_hooks', batch_size=2)
+
+        assert things() == [0, 1, 2]
+        assert OutboxHook.objects.count() == 0
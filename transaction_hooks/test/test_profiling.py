@@ -0,0 +1,96 @@
+from django.core.management import call_command
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils.six import StringIO
+import pytest
+
+from transaction_hooks import profiling
+from .test_basic import ForcedError
+
+
+def hook():
+    pass
+
+
+def slow_hook():
+    for _ in range(10000):
+        pass
+
+
+@pytest.fixture
+def profile(monkeypatch):
+    """Profile the default connection's hooks, in a fresh HookProfile."""
+    monkeypatch.setattr(profiling, 'profile', profiling.HookProfile())
+    monkeypatch.setattr(connection, 'commit_hook_profile', 'qualname')
+    return profiling.profile
+
+
+def register_hook():
+    connection.on_commit(hook)
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestHookProfile(object):
+    def test_counts_across_transactions(self, profile):
+        for _ in range(2):
+            with atomic():
+                connection.on_commit(hook)
+                connection.on_commit_call(slow_hook)
+                try:
+                    with atomic():
+                        connection.on_commit(hook)
+                        raise ForcedError()
+                except ForcedError:
+                    pass
+
+        site = profile.sites['transaction_hooks.test.test_profiling.hook']
+        assert (site.registered, site.discarded, site.executed) == (4, 2, 2)
+        assert site.discard_rate == 0.5
+        slow = profile.sites[
+            'transaction_hooks.test.test_profiling.slow_hook']
+        assert slow.executed == 2
+        assert 0 < slow.max <= slow.total
+
+    def test_key_duplicates_discarded(self, profile):
+        with atomic():
+            connection.on_commit(hook, key='k', priority=1)
+            connection.on_commit(hook, key='k', priority=1)
+
+        [site] = profile.sites.values()
+        assert (site.registered, site.discarded, site.executed) == (2, 1, 1)
+
+    def test_call_site(self, profile, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_profile', 'callsite')
+        with atomic():
+            register_hook()
+
+        [site] = profile.sites
+        assert site.endswith('test_profiling.py:%d in register_hook' % (
+            register_hook.__code__.co_firstlineno + 1))
+
+    def test_not_profiled_by_default(self, profile, monkeypatch):
+        monkeypatch.setattr(connection, 'commit_hook_profile', None)
+        with atomic():
+            connection.on_commit(hook)
+
+        assert profile.sites == {}
+
+
+@pytest.mark.usefixtures('transactional_db')
+def test_save_and_report(profile, settings, tmpdir):
+    settings.TRANSACTION_HOOKS_PROFILE_DIR = str(tmpdir)
+    with atomic():
+        connection.on_commit(hook)
+        connection.on_commit(slow_hook)
+    profiling.save()
+    # another process's profile
+    tmpdir.join('1.json').write(profile.dumps())
+
+    out = StringIO()
+    call_command('commit_hook_profile', stdout=out, reset=True)
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 3
+    assert lines[1].split()[0] == '2'
+    assert lines[1].endswith('slow_hook')
+    assert tmpdir.listdir() == []
@@ -0,0 +1,72 @@
+from django.db.models.signals import post_delete, post_save
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks.receivers import commit_receiver
+from .models import Thing
+from .test_basic import ForcedError
+
+
+received = []
+
+
+@pytest.fixture
+def receiver(request):
+    """Connect a commit receiver to Thing's post_save and post_delete."""
+    del received[:]
+
+    @commit_receiver([post_save, post_delete], sender=Thing,
+                     dispatch_uid='test_receivers')
+    def things_changed(sender, batch):
+        received.append((sender, [
+            (kwargs['instance'].num, kwargs['signal'] is post_save)
+            for kwargs in batch
+        ]))
+
+    def disconnect():
+        post_save.disconnect(sender=Thing, dispatch_uid='test_receivers')
+        post_delete.disconnect(sender=Thing, dispatch_uid='test_receivers')
+    request.addfinalizer(disconnect)
+
+
+@pytest.mark.usefixtures('transactional_db', 'receiver')
+class TestCommitReceiver(object):
+    def test_called_once_per_transaction(self):
+        with atomic():
+            for num in range(3):
+                Thing.objects.create(num=num)
+            assert received == []
+
+        assert received == [
+            (Thing, [(0, True), (1, True), (2, True)]),
+        ]
+
+    def test_drops_calls_from_rolled_back_savepoint(self):
+        with atomic():
+            Thing.objects.create(num=1)
+            try:
+                with atomic():
+                    Thing.objects.create(num=2)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            thing = Thing.objects.create(num=3)
+            thing.delete()
+
+        # post_delete calls are collected together with post_save calls
+        assert received == [(Thing, [(1, True), (3, True), (3, False)])]
+
+    def test_not_called_if_rolled_back(self):
+        try:
+            with atomic():
+                Thing.objects.create(num=1)
+                raise ForcedError()
+        except ForcedError:
+            pass
+
+        assert received == []
+
+    def test_called_immediately_outside_transaction(self):
+        Thing.objects.create(num=1)
+
+        assert received == [(Thing, [(1, True)])]
@@ -0,0 +1,146 @@
+from functools import partial
+
+from django.db import connection
+from django.db.transaction import atomic
+import pytest
+
+from transaction_hooks.spill import SpillableQueue
+from .test_basic import ForcedError
+
+
+notified = []
+
+
+def notify(n):
+    notified.append(n)
+
+
+def notify_done():
+    notified.append('done')
+
+
+class Accumulator(object):
+    def __init__(self):
+        self.items = []
+
+    def add(self):
+        self.items.append(1)
+
+
+@pytest.fixture
+def spilling(monkeypatch):
+    """Spill the default connection's pending hooks every 3 hooks."""
+    del notified[:]
+    monkeypatch.setattr(connection, 'commit_hook_spill_threshold', 3)
+    monkeypatch.setattr(connection, 'run_on_commit', SpillableQueue(3))
+    yield connection.run_on_commit
+    connection.run_on_commit.close()
+
+
+class TestSpillableQueue(object):
+    def test_fifo_across_chunks(self):
+        queue = SpillableQueue(2)
+        queue.extend(range(7))
+        assert queue.chunks
+        assert len(queue) == 7
+        assert list(queue) == list(range(7))
+        assert [queue.popleft() for _ in range(7)] == list(range(7))
+        assert len(queue) == 0
+
+    def test_pop_across_chunks(self):
+        queue = SpillableQueue(2)
+        queue.extend(range(7))
+        assert [queue.pop() for _ in range(4)] == [6, 5, 4, 3]
+        queue.extend([7, 8, 9])
+        assert [queue.popleft() for _ in range(6)] == [0, 1, 2, 7, 8, 9]
+
+    def test_unpicklable_hooks_kept_in_order(self):
+        queue = SpillableQueue(2)
+        funcs = [notify_done, lambda: None, notify_done]
+        queue.extend(funcs)
+        assert len(queue.kept) == 1
+        assert [queue.popleft() for _ in range(3)][1] is funcs[1]
+        assert queue.kept == {}
+
+    def test_hooks_over_objects_kept_not_copied(self):
+        accumulator = Accumulator()
+        seen = []
+        queue = SpillableQueue(2)
+        queue.append(accumulator.add)
+        queue.append(partial(seen.append, 'x'))
+        queue.append(partial(notify, 1))
+        queue.append(notify_done)
+        assert len(queue.kept) == 3
+        while queue:
+            queue.popleft()()
+        assert accumulator.items == [1]
+        assert seen == ['x']
+
+    def test_file_emptied_once_drained(self):
+        queue = SpillableQueue(2)
+        for _ in range(3):
+            queue.extend(range(7))
+            while queue:
+                queue.popleft()
+            queue.file.seek(0, 2)
+            assert queue.file.tell() == 0
+
+    def test_file_reused_after_pop_and_popleft(self):
+        queue = SpillableQueue(2)
+        queue.extend(range(6))
+        assert queue.popleft() == 0
+        assert [queue.pop() for _ in range(4)] == [5, 4, 3, 2]
+        queue.extend(range(2))
+        assert queue.chunks[0][0] == 0
+        assert list(queue) == [1, 0, 1]
+
+    def test_clear(self):
+        queue = SpillableQueue(2)
+        queue.extend(range(5))
+        queue.clear()
+        assert len(queue) == 0
+        queue.append(1)
+        assert list(queue) == [1]
+
+
+@pytest.mark.usefixtures('transactional_db')
+class TestSpilledHooks(object):
+    def test_run_in_order(self, spilling):
+        with atomic():
+            for i in range(10):
+                connection.on_commit_call(notify, i)
+            connection.on_commit(lambda: notify('closure'))
+            assert spilling.spilled
+
+        assert notified == list(range(10)) + ['closure']
+
+    def test_call_records_spilled(self, spilling):
+        with atomic():
+            for i in range(10):
+                connection.on_commit_call(notify, i)
+            assert spilling.spilled == 9
+            assert not spilling.kept
+
+        assert notified == list(range(10))
+
+    def test_discarded_with_savepoint(self, spilling):
+        with atomic():
+            for i in range(4):
+                connection.on_commit_call(notify, i)
+            try:
+                with atomic():
+                    for i in range(4, 11):
+                        connection.on_commit_call(notify, i)
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_commit_call(notify, 11)
+
+        assert notified == [0, 1, 2, 3, 11]
+
+    def test_priorities(self, spilling):
+        with atomic():
+            for i in range(7):
+                connection.on_commit(partial(notify, i), priority=i % 2)
+
+        assert notified == [1, 3, 5, 0, 2, 4, 6]
@@ -0,0 +1,95 @@
+from django.db import connection
+from django.db.transaction import TransactionManagementError, atomic
+from django.test import TestCase
+import pytest
+
+from transaction_hooks.testing import capture_commit_hooks, commit_hooks  # noqa
+from .test_basic import ForcedError, track  # noqa
+
+
+@pytest.mark.usefixtures('db')
+class TestCaptureCommitHooks(object):
+    def test_captures_and_runs_hooks(self, track):
+        with capture_commit_hooks() as hooks:
+            track.do(1)
+            connection.on_commit_call(track.notify, 2)
+        track.assert_notified([])
+        assert len(hooks) == 2
+
+        hooks.run()
+
+        track.assert_notified([1, 2])
+        assert len(hooks) == 0
+
+    def test_execute(self, track):
+        with capture_commit_hooks(execute=True):
+            connection.on_commit(lambda: track.notify(1))
+            track.assert_notified([])
+
+        track.assert_notified([1])
+
+    def test_discards_hooks_from_rolled_back_savepoint(self, track):
+        with capture_commit_hooks(execute=True) as hooks:
+            connection.on_commit(lambda: track.notify(1))
+            try:
+                with atomic():
+                    connection.on_commit(lambda: track.notify(2))
+                    connection.on_before_commit(lambda: track.notify(3))
+                    raise ForcedError()
+            except ForcedError:
+                pass
+            connection.on_before_commit(lambda: track.notify(4))
+            assert len(hooks) == 1
+            assert len(hooks.before_commit_hooks) == 1
+
+        track.assert_notified([4, 1])
+
+    def test_leaves_earlier_hooks_pending(self, track):
+        connection.on_commit(lambda: track.notify(1))
+        with capture_commit_hooks(execute=True):
+            connection.on_commit(lambda: track.notify(2))
+
+        track.assert_notified([2])
+        assert len(connection.run_on_commit) == 1
+
+    def test_runs_hooks_registered_by_hooks(self, track):
+        def hook():
+            track.notify(1)
+            connection.on_commit(lambda: track.notify(2))
+
+        with capture_commit_hooks(execute=True):
+            connection.on_commit(hook)
+            connection.on_commit(lambda: track.notify(3), priority=1)
+
+        track.assert_notified([3, 1, 2])
+
+    def test_keys_and_batches(self, track):
+        with capture_commit_hooks(execute=True):
+            connection.on_commit(lambda: track.notify(1), key='k')
+            connection.on_commit(lambda: track.notify(2), key='k')
+            connection.on_commit_batch(track.notify, 3)
+            connection.on_commit_batch(track.notify, 4)
+
+        track.assert_notified([1, [3, 4]])
+
+    def test_fixture(self, track, commit_hooks):  # noqa
+        connection.on_commit(lambda: track.notify(1))
+        track.assert_notified([])
+        commit_hooks.run()
+        track.assert_notified([1])
+
+
+def test_requires_transaction(transactional_db):
+    with pytest.raises(TransactionManagementError):
+        with capture_commit_hooks():
+            pass
+
+
+class CaptureInTestCaseTests(TestCase):
+    def test_capture(self):
+        notified = []
+        with capture_commit_hooks() as hooks:
+            connection.on_commit(lambda: notified.append(1))
+        self.assertEqual(len(hooks), 1)
+        hooks.run()
+        self.assertEqual(notified, [1])
@@ -0,0 +1,182 @@
+"""
+Capture on-commit hooks in tests that run inside a transaction.
+
+Django's ``TestCase`` (and pytest-django's ``db`` fixture) wrap each test in
+a transaction that is rolled back rather than committed, so hooks registered
+in the test never run. ``capture_commit_hooks`` collects the hooks
+registered in its block instead, and runs them when asked::
+
+    with capture_commit_hooks() as hooks:
+        do_something_that_registers_hooks()
+    assert len(hooks) == 1
+    hooks.run()
+
+For pytest, the ``commit_hooks`` fixture captures the hooks registered
+during the whole test; add ``pytest_plugins = ['transaction_hooks.testing']``
+to your ``conftest.py`` to use it.
+
+"""
+from collections import deque
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.transaction import TransactionManagementError
+
+
+# the connection attributes that hold a transaction's pending hooks
+HOOK_STATE = (
+    'run_on_commit',
+    'run_before_commit',
+    'commit_hook_keys',
+    'commit_hook_batches',
+    'commit_hook_dispatch',
+    'commit_hook_priorities',
+    'commit_hook_async_group',
+)
+
+
+def new_hook_state(connection):
+    return {
+        'run_on_commit': connection._new_commit_hook_queue(),
+        'run_before_commit': deque(),
+        'commit_hook_keys': {},
+        'commit_hook_batches': {},
+        'commit_hook_dispatch': {},
+        'commit_hook_priorities': False,
+        'commit_hook_async_group': None,
+    }
+
+
+class CapturedCommitHooks(object):
+    """
+    The hooks registered in a ``capture_commit_hooks`` block.
+
+    Hooks registered under a savepoint that is rolled back are discarded, as
+    they would be in a real transaction; deduplication keys, batches and
+    priorities apply among the captured hooks as if they were registered in a
+    transaction of their own.
+
+    """
+    def __init__(self, using):
+        self.connection = connections[using]
+        self.state = new_hook_state(self.connection)
+        self.active = False
+
+    def __len__(self):
+        return len(self.hooks)
+
+    def __iter__(self):
+        return iter(self.hooks)
+
+    @property
+    def hooks(self):
+        """The pending on-commit hooks, as queued (in registration order)."""
+        return list(self._state()['run_on_commit'])
+
+    @property
+    def before_commit_hooks(self):
+        """The pending before-commit hooks, in registration order."""
+        return list(self._state()['run_before_commit'])
+
+    def _state(self):
+        if self.active:
+            return dict((name, getattr(self.connection, name))
+                        for name in HOOK_STATE)
+        return self.state
+
+    @contextmanager
+    def installed(self):
+        """Make the captured hooks the connection's pending hooks."""
+        if self.active:
+            yield
+            return
+        connection = self.connection
+        saved = {}
+        for name in HOOK_STATE:
+            saved[name] = getattr(connection, name)
+            setattr(connection, name, self.state[name])
+        self.active = True
+        try:
+            yield
+        finally:
+            for name in HOOK_STATE:
+                self.state[name] = getattr(connection, name)
+                setattr(connection, name, saved[name])
+            self.active = False
+
+    def run(self):
+        """
+        Run the captured hooks, as if the transaction had committed.
+
+        Before-commit hooks run first, then on-commit hooks in priority order,
+        including any that they register in turn. Hooks bound for an executor
+        run on the calling thread, after the others; coroutine hooks are
+        scheduled on the event loop as usual.
+
+        """
+        connection = self.connection
+        with self.installed():
+            pending = connection.run_before_commit
+            while pending:
+                func = pending.popleft()
+                func()
+            connection.commit_hook_keys = {}
+            connection.commit_hook_batches = {}
+            dispatch, connection.commit_hook_dispatch = (
+                connection.commit_hook_dispatch, {})
+            group, connection.commit_hook_async_group = (
+                connection.commit_hook_async_group, None)
+            if connection.commit_hook_priorities:
+                connection._order_commit_hooks_by_priority()
+            try:
+                pending = connection.run_on_commit
+                while pending:
+                    func = pending.popleft()
+                    func()
+            finally:
+                connection.run_on_commit.clear()
+                if group is not None:
+                    group.close()
+            # executor hooks run inline here, not through
+            # executors.run_hooks, which would close the test's connection
+            for funcs in dispatch.values():
+                for func in funcs:
+                    func()
+
+
+@contextmanager
+def capture_commit_hooks(using=DEFAULT_DB_ALIAS, execute=False):
+    """
+    Capture the hooks registered on ``using`` in the block, and return them
+    as a ``CapturedCommitHooks``.
+
+    Must be used inside a transaction, e.g. in a ``TestCase`` test. If
+    ``execute`` is true, the hooks are run when the block exits without an
+    error.
+
+    """
+    captured = CapturedCommitHooks(using)
+    if not captured.connection.in_atomic_block:
+        raise TransactionManagementError(
+            "capture_commit_hooks() requires an active transaction.")
+    with captured.installed():
+        yield captured
+    if execute:
+        captured.run()
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def commit_hooks(db):
+        """
+        Capture the hooks registered on the default database during the test
+        and return them as a ``CapturedCommitHooks``.
+
+        """
+        with capture_commit_hooks() as captured:
+            yield captured